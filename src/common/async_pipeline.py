@@ -0,0 +1,218 @@
+import asyncio
+import sys
+from argparse import Namespace
+from io import StringIO
+from typing import Callable, Optional
+
+from chess import Board, Move, WHITE, BLACK
+from chess.engine import INFO_SCORE, INFO_PV, UciProtocol
+from chess.pgn import read_game
+from pymongo.asynchronous.database import AsyncDatabase
+from tqdm import tqdm
+
+from .bypass import evaluate_without_engine
+from .budget import get_budget_policy
+from .checkpoint import GameCheckpoint
+from .config import config
+from .db import make_db, make_async_db, collation, is_complete
+from .engine import limit, is_deterministic_limit
+from .eval_cache import eval_cache, search_key
+from .filters import merge_filters
+from .stats import increment
+from .supervisor import AsyncEngineSupervisor, PositionQuarantined
+from .util import (
+    score_value,
+    rank_move_accuracy,
+    expected_engine_calls,
+    get_user_color,
+    count_user_games
+)
+
+async def evaluate_move_async(board: Board, protocol: UciProtocol, move: Move, game: str, factor: float) -> float:
+    info = await protocol.analyse(board, limit(factor), root_moves=[move], multipv=1, info=INFO_SCORE, game=game)
+    return score_value(info[0]['score'])
+
+async def evaluate_moves_async(board: Board, protocol: UciProtocol, moves: list[Move],
+                               ranking_mode: str, game: str, factor: float) -> dict[Move, float]:
+    if ranking_mode != 'multipv':
+        return {move: await evaluate_move_async(board, protocol, move, game, factor) for move in moves}
+    lines = config['multipv-lines']
+    move_values = {}
+    for chunk_start in range(0, len(moves), lines):
+        chunk = moves[chunk_start:chunk_start + lines]
+        infos = await protocol.analyse(board, limit(factor), root_moves=chunk, multipv=len(chunk),
+                                       info=INFO_SCORE | INFO_PV, game=game)
+        for info in infos:
+            if info.get('pv') and 'score' in info:
+                move_values[info['pv'][0]] = score_value(info['score'])
+        for move in chunk:
+            if move not in move_values:
+                move_values[move] = await evaluate_move_async(board, protocol, move, game, factor)
+    return move_values
+
+async def evaluate_position_async(db, board: Board, protocol: UciProtocol,
+                                  ranking_mode: str, game: str, factor: float = 1) -> dict[Move, float]:
+    legal_moves = list(board.legal_moves)
+    move_values = evaluate_without_engine(board, legal_moves)
+    if move_values is not None:
+        increment('engine-calls-avoided', expected_engine_calls(ranking_mode, len(legal_moves)))
+        return move_values
+    search = search_key(ranking_mode, factor)
+    if is_deterministic_limit():
+        # the persistent cache level is blocking, keep it off the event loop
+        move_values = await asyncio.to_thread(eval_cache.get_many, db, board, legal_moves, search)
+    else:
+        move_values = eval_cache.get_many(None, board, legal_moves, search)
+    missing_moves = [move for move in legal_moves if move not in move_values]
+    if missing_moves:
+        searched_values = await evaluate_moves_async(board, protocol, missing_moves, ranking_mode, game, factor)
+        if is_deterministic_limit():
+            await asyncio.to_thread(eval_cache.put_many, db, board.copy(), searched_values, search)
+        else:
+            eval_cache.put_many(None, board, searched_values, search)
+        move_values.update(searched_values)
+    return move_values
+
+async def score_move_async(db, board: Board, protocol: UciProtocol, move: Move,
+                           ranking_mode: str, game: str) -> tuple[float, float]:
+    policy = get_budget_policy()
+    factor = policy.initial_factor(board)
+    while True:
+        move_values = await evaluate_position_async(db, board, protocol, ranking_mode, game, factor)
+        next_factor = policy.next_factor(board, move_values, move, factor)
+        if next_factor is None:
+            return rank_move_accuracy(move_values, move), factor
+        increment('budget-escalations')
+        factor = next_factor
+
+class AnalysisPipeline:
+    def __init__(self, args: Namespace, both_sides: bool,
+                 on_result: Callable[[str, dict[bool, list[float]]], None],
+                 skip_game: Optional[Callable[[dict], bool]] = None):
+        self.args = args
+        self.both_sides = both_sides
+        self.on_result = on_result
+        self.skip_game = skip_game
+        self.engine_count = args.worker_count
+        self.jobs = asyncio.Queue(maxsize=self.engine_count * 2)
+        self.pending_writes = []
+        self.pending_digests = []
+        self.pbar = None
+
+    async def run(self) -> None:
+        db = make_async_db()
+        sync_db = make_db()
+        game_count = count_user_games(sync_db, self.args)
+        with tqdm(total=game_count, smoothing=False) as self.pbar:
+            tasks = [asyncio.create_task(self.produce(db))]
+            tasks += [asyncio.create_task(self.consume(db, sync_db)) for _ in range(self.engine_count)]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await self.flush(db)
+                await db.client.close()
+
+    async def produce(self, db: AsyncDatabase) -> None:
+        _filter = merge_filters(self.args)
+        _filter.update({'invalid': { '$exists': False }})
+        cursor = db.games.find(_filter, {'pgn': 1, 'hexdigest': 1, 'tags': 1, 'white_accuracy': 1,
+                                         'black_accuracy': 1}, collation=collation())
+        if self.args.limit is not None:
+            cursor = cursor.limit(self.args.limit)
+        async for game_document in cursor:
+            if self.skip_game and self.skip_game(game_document):
+                continue
+            game = read_game(StringIO(game_document['pgn']))
+            if self.both_sides:
+                players = {WHITE: game.headers['White'], BLACK: game.headers['Black']}
+            else:
+                players = {get_user_color(self.args.username, game): self.args.username}
+            await self.jobs.put((game_document, game, players))
+        for _ in range(self.engine_count):
+            await self.jobs.put(None)
+
+    async def consume(self, db: AsyncDatabase, sync_db) -> None:
+        supervisor = AsyncEngineSupervisor()
+        await supervisor.start()
+        try:
+            while True:
+                job = await self.jobs.get()
+                if job is None:
+                    return
+                game_document, game, players = job
+                try:
+                    move_accuracy = await self.analyse_game(db, sync_db, supervisor, game,
+                                                            game_document['hexdigest'], players)
+                except PositionQuarantined as e:
+                    print(e, file=sys.stderr)
+                    move_accuracy = {color: [] for color in players}
+                self.on_result(game_document['hexdigest'], move_accuracy)
+                self.pbar.update(1)
+        finally:
+            supervisor.close()
+
+    async def analyse_game(self, db: AsyncDatabase, sync_db, supervisor: AsyncEngineSupervisor, game,
+                           hexdigest: str, players: dict[bool, str]) -> dict[bool, list[float]]:
+        move_accuracy = {}
+        progress = {color: [] for color in players}
+        existing = db.move_accuracy.find({'hexdigest': hexdigest, 'username': {'$in': list(players.values())}})
+        async for document in existing:
+            for color, username in players.items():
+                if document['username'] != username:
+                    continue
+                if is_complete(document):
+                    move_accuracy[color] = document['move_accuracy']
+                    del progress[color]
+                else:
+                    progress[color] = document['move_accuracy']
+        if not progress:
+            return move_accuracy
+        checkpoint = GameCheckpoint(hexdigest, players, progress)
+        color_plies = {color: 0 for color in progress}
+        board = game.board()
+        try:
+            for actual_move in game.mainline_moves():
+                color = board.turn
+                if color in progress and color_plies[color] >= checkpoint.scored_count(color):
+                    raw_move_accuracy, budget = await supervisor.run(sync_db, board, hexdigest, lambda protocol: score_move_async(
+                        sync_db, board, protocol, actual_move, self.args.ranking_mode, hexdigest))
+                    checkpoint.record(color, raw_move_accuracy, budget)
+                    if checkpoint.due():
+                        await db.move_accuracy.bulk_write(checkpoint.drain(complete=False))
+                if color in progress:
+                    color_plies[color] += 1
+                board.push(actual_move)
+        except BaseException:
+            requests = checkpoint.drain(complete=False)
+            if requests:
+                await db.move_accuracy.bulk_write(requests)
+            raise
+        self.pending_writes += checkpoint.drain(complete=True)
+        self.pending_digests.append(hexdigest)
+        if len(self.pending_writes) >= config['async-write-batch']:
+            await self.flush(db)
+        move_accuracy.update(checkpoint.move_accuracy())
+        return move_accuracy
+
+    async def flush(self, db: AsyncDatabase) -> None:
+        requests, self.pending_writes = self.pending_writes, []
+        hexdigests, self.pending_digests = self.pending_digests, []
+        if not requests:
+            return
+        await db.move_accuracy.bulk_write(requests, ordered=False)
+        await db.games.update_many({'hexdigest': {'$in': hexdigests}},
+                                   {'$addToSet': { 'tags': 'accuracy'}})
+
+def check_pipeline_options(args: Namespace) -> bool:
+    # engines are started with popen_uci on this host, remote and tcp:// engines need the thread pool
+    if args.pipeline == 'asyncio' and args.remote_engines:
+        print('The asyncio pipeline only runs local engines, use --pipeline threads with --remote-engines',
+              file=sys.stderr)
+        return False
+    return True
+
+def analyse_games_async(args: Namespace, on_result: Callable[[str, dict[bool, list[float]]], None],
+                        both_sides: bool = False, skip_game: Optional[Callable[[dict], bool]] = None) -> None:
+    asyncio.run(AnalysisPipeline(args, both_sides, on_result, skip_game).run())
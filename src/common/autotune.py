@@ -0,0 +1,132 @@
+import math
+import os
+import sys
+import time
+from argparse import Namespace
+from itertools import cycle
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from chess import Board
+from chess.engine import Limit
+
+from .config import write_config
+from .engine import make_local_engine
+
+# a fixed amount of work per search, a time limit would take as long with any
+# number of threads and hide what threads and hash buy
+CALIBRATION_NODES = 200000
+MIN_HASH_MB = 16
+MAX_HASH_MB = 4096
+# leave half of the memory to the os, mongod and the tablebase cache
+ENGINE_MEMORY_SHARE = 0.5
+
+CALIBRATION_FENS = [
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+    'r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4',
+    'r2q1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP3PPP/R2QKB1R w KQ - 0 9',
+    '2r2rk1/pp1bqppp/2n1pn2/3p4/3P4/2PBPN2/PQ3PPP/R4RK1 b - - 3 14',
+    '8/5pk1/6p1/3R4/5P2/6P1/r5K1/8 w - - 0 40',
+]
+
+def read_first_line(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+def cgroup_cpu_limit() -> Optional[float]:
+    cpu_max = read_first_line('/sys/fs/cgroup/cpu.max')
+    if cpu_max:
+        quota, period = cpu_max.split()
+        return None if quota == 'max' else int(quota) / int(period)
+    quota = read_first_line('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')
+    period = read_first_line('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+def cgroup_memory_limit() -> Optional[int]:
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        limit = read_first_line(path)
+        # cgroup v1 reports an unset limit as a huge page-aligned number
+        if limit and limit != 'max' and int(limit) < 1 << 62:
+            return int(limit)
+    return None
+
+def usable_cores() -> int:
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    quota = cgroup_cpu_limit()
+    if quota is not None:
+        cores = min(cores, max(1, math.floor(quota)))
+    return cores
+
+def usable_memory_mb() -> int:
+    memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    limit = cgroup_memory_limit()
+    if limit is not None:
+        memory = min(memory, limit)
+    return memory // (1024 * 1024)
+
+def hash_size_mb(memory_mb: int, workers: int) -> int:
+    share = int(memory_mb * ENGINE_MEMORY_SHARE) // workers
+    # stockfish rounds the transposition table down to a power of two anyway
+    size = 1 << max(0, share.bit_length() - 1)
+    return max(MIN_HASH_MB, min(MAX_HASH_MB, size))
+
+def candidate_profiles(cores: int, memory_mb: int) -> list[dict]:
+    profiles = []
+    threads = 1
+    while threads <= cores:
+        workers = cores // threads
+        profiles.append({
+            'worker-count': workers,
+            'engine-threads': threads,
+            'engine-hash-mb': hash_size_mb(memory_mb, workers)
+        })
+        threads *= 2
+    return profiles
+
+def measure_worker(profile: dict, boards: list[Board], seconds: float) -> float:
+    engine = make_local_engine(profile['engine-threads'], profile['engine-hash-mb'])
+    positions = 0
+    try:
+        # engine startup is not part of the measurement
+        start = time.monotonic()
+        for board in cycle(boards):
+            elapsed = time.monotonic() - start
+            if elapsed >= seconds:
+                return positions / elapsed
+            engine.analyse(board, Limit(nodes=CALIBRATION_NODES))
+            positions += 1
+    finally:
+        engine.quit()
+
+def calibrate(profile: dict, seconds: float) -> float:
+    boards = [Board(fen) for fen in CALIBRATION_FENS]
+    workers = profile['worker-count']
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # each worker starts at a different position so they don't search in lockstep
+        futures = [executor.submit(measure_worker, profile, boards[idx:] + boards[:idx], seconds)
+                   for idx in (worker % len(boards) for worker in range(workers))]
+        return sum(future.result() for future in futures)
+
+def auto_tune(seconds: float) -> dict:
+    cores, memory_mb = usable_cores(), usable_memory_mb()
+    print(f'Auto-tune: {cores} usable cores, {memory_mb} MB usable memory', file=sys.stderr)
+    best_profile, best_rate = None, -1
+    for profile in candidate_profiles(cores, memory_mb):
+        rate = calibrate(profile, seconds)
+        print(f'  {profile["worker-count"]} workers x {profile["engine-threads"]} threads, '
+              f'{profile["engine-hash-mb"]} MB hash: {rate:.1f} positions/s', file=sys.stderr)
+        if rate > best_rate:
+            best_profile, best_rate = profile, rate
+    write_config(best_profile)
+    print(f'Auto-tune: saved {best_profile["worker-count"]} workers x {best_profile["engine-threads"]} threads, '
+          f'{best_profile["engine-hash-mb"]} MB hash', file=sys.stderr)
+    return best_profile
+
+def apply_auto_tune(args: Namespace) -> None:
+    if getattr(args, 'auto_tune', False):
+        args.worker_count = auto_tune(args.auto_tune_seconds)['worker-count']
@@ -0,0 +1,59 @@
+from collections import Counter
+from typing import Optional
+
+from chess import Board, Move
+
+from .config import config
+from .stats import register_reporter
+
+MIN_FACTOR = 0.25
+MAX_FACTOR = 4
+ESCALATION = 4
+# positions with this few legal moves never get more than the base budget
+FEW_MOVES = 5
+# values closer than this could swap order on a deeper search
+RANK_MARGIN_CP = 20
+# a best move this far ahead of the rest is not going to be overtaken
+DECISIVE_GAP_CP = 150
+
+class FixedBudget:
+    def initial_factor(self, board: Board) -> float:
+        return 1
+
+    def next_factor(self, board: Board, move_values: dict[Move, float], move: Move, factor: float) -> Optional[float]:
+        return None
+
+class AdaptiveBudget:
+    def initial_factor(self, board: Board) -> float:
+        return MIN_FACTOR
+
+    def max_factor(self, board: Board) -> float:
+        return 1 if board.legal_moves.count() <= FEW_MOVES else MAX_FACTOR
+
+    def next_factor(self, board: Board, move_values: dict[Move, float], move: Move, factor: float) -> Optional[float]:
+        if factor * ESCALATION > self.max_factor(board) or move not in move_values:
+            return None
+        return factor * ESCALATION if is_rank_uncertain(move_values, move) else None
+
+def is_rank_uncertain(move_values: dict[Move, float], move: Move) -> bool:
+    values = sorted(set(move_values.values()), reverse=True)
+    if len(values) > 1 and values[0] - values[1] >= DECISIVE_GAP_CP and move_values[move] == values[0]:
+        return False
+    played_value = move_values[move]
+    return any(0 < abs(value - played_value) < RANK_MARGIN_CP for value in values)
+
+BUDGET_POLICIES = {
+    'fixed': FixedBudget(),
+    'adaptive': AdaptiveBudget()
+}
+
+def get_budget_policy():
+    return BUDGET_POLICIES[config['budget-policy']]
+
+def format_budget_stats(counters: Counter) -> Optional[str]:
+    escalations = counters['budget-escalations']
+    if not escalations:
+        return None
+    return f'Search budget: {escalations} positions searched again with a larger budget'
+
+register_reporter(format_budget_stats)
@@ -0,0 +1,73 @@
+from collections import Counter
+from os import path as op
+from threading import Lock
+from typing import Optional
+
+from chess import Board, Move, popcount
+from chess.syzygy import Tablebase, open_tablebase
+
+from .config import config
+from .stats import increment, register_reporter
+
+tablebase = None
+tablebase_lock = Lock()
+
+def get_tablebase() -> Optional[Tablebase]:
+    global tablebase
+    with tablebase_lock:
+        if tablebase is None and op.isdir(config['syzygy-path']):
+            tablebase = open_tablebase(config['syzygy-path'])
+        return tablebase
+
+def is_tablebase_position(board: Board) -> bool:
+    return popcount(board.occupied) <= config['syzygy-max-pieces'] and not board.castling_rights
+
+def tablebase_value(wdl: int, dtz: int) -> float:
+    # wdl and dtz are from the point of view of the side that just moved,
+    # faster wins and slower losses rank higher
+    if wdl == 2:
+        return 10000 - abs(dtz)
+    if wdl == -2:
+        return -10000 + abs(dtz)
+    return wdl
+
+def probe_move_values(board: Board, moves: list[Move]) -> Optional[dict[Move, float]]:
+    tb = get_tablebase()
+    if tb is None or not is_tablebase_position(board):
+        return None
+    move_values = {}
+    for move in moves:
+        child = board.copy(stack=False)
+        child.push(move)
+        if child.is_checkmate():
+            move_values[move] = 10000
+            continue
+        try:
+            wdl = tb.probe_wdl(child)
+            dtz = tb.probe_dtz(child)
+        except KeyError:
+            return None
+        move_values[move] = tablebase_value(-wdl, -dtz)
+    return move_values
+
+def can_bypass_engine(board: Board, move_count: int) -> bool:
+    return move_count == 1 or (get_tablebase() is not None and is_tablebase_position(board))
+
+def evaluate_without_engine(board: Board, moves: list[Move]) -> Optional[dict[Move, float]]:
+    if len(moves) == 1:
+        increment('engine-bypass-forced')
+        return {moves[0]: 0}
+    move_values = probe_move_values(board, moves)
+    if move_values is not None:
+        increment('engine-bypass-tablebase')
+    return move_values
+
+def format_bypass_stats(counters: Counter) -> Optional[str]:
+    forced = counters['engine-bypass-forced']
+    tablebase_hits = counters['engine-bypass-tablebase']
+    if not forced and not tablebase_hits:
+        return None
+    return (f'Engine bypass: {forced} forced moves, {tablebase_hits} tablebase positions, '
+            f'{counters["engine-calls-avoided"]} engine calls avoided')
+
+register_reporter(format_bypass_stats)
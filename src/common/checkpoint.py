@@ -0,0 +1,39 @@
+import time
+
+from pymongo import UpdateOne
+
+from .config import config
+from .db import checkpoint_move_accuracy
+
+class GameCheckpoint:
+    def __init__(self, hexdigest: str, players: dict[bool, str], progress: dict[bool, list[float]]):
+        self.hexdigest = hexdigest
+        self.players = players
+        self.saved = progress
+        self.unsaved = {color: [] for color in progress}
+        self.budgets = {color: [] for color in progress}
+        self.last_write = time.monotonic()
+
+    def scored_count(self, color: bool) -> int:
+        return len(self.saved[color]) + len(self.unsaved[color])
+
+    def record(self, color: bool, value: float, budget: float) -> None:
+        self.unsaved[color].append(value)
+        self.budgets[color].append(budget)
+
+    def due(self) -> bool:
+        return time.monotonic() - self.last_write >= config['checkpoint-seconds']
+
+    def drain(self, complete: bool) -> list[UpdateOne]:
+        requests = [checkpoint_move_accuracy(self.hexdigest, self.players[color], len(self.saved[color]), scored,
+                                             self.budgets[color], complete)
+                    for color, scored in self.unsaved.items() if scored or complete]
+        for color, scored in self.unsaved.items():
+            self.saved[color] = self.saved[color] + scored
+        self.unsaved = {color: [] for color in self.unsaved}
+        self.budgets = {color: [] for color in self.unsaved}
+        self.last_write = time.monotonic()
+        return requests
+
+    def move_accuracy(self) -> dict[bool, list[float]]:
+        return {color: self.saved[color] + self.unsaved[color] for color in self.saved}
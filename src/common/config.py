@@ -6,7 +6,31 @@ import os
 DATA_DIR = appdirs.user_data_dir(appname='chess-playground')
 DEFAULT_CONFIG = {
     "downloader-user-agent-username": "anonymous",
-    "think-time-seconds": 0.001
+    "think-time-seconds": 0.001,
+    "ranking-mode": "per-move",
+    "multipv-lines": 256,
+    "search-nodes": None,
+    "search-depth": None,
+    "eval-cache-size": 200000,
+    "syzygy-path": "./3-4-5",
+    "syzygy-max-pieces": 5,
+    "async-write-batch": 100,
+    "job-lease-seconds": 120,
+    "job-max-attempts": 3,
+    "job-poll-seconds": 5,
+    "remote-connect-attempts": 3,
+    "checkpoint-seconds": 5,
+    "engine-retry-attempts": 3,
+    "engine-retry-backoff-seconds": 1,
+    "worker-count": 4,
+    "engine-threads": 2,
+    "engine-hash-mb": 16,
+    "remote-engine-threads": 2,
+    "remote-engine-hash-mb": 32,
+    "auto-tune-seconds": 3,
+    "budget-policy": "fixed",
+    "db-uri": "mongodb://localhost:27017",
+    "db-pool-size": 32
 }
 
 if not op.exists(DATA_DIR):
@@ -26,4 +50,8 @@ def read_config() -> dict:
 def write_default_config() -> None:
     json.dump(DEFAULT_CONFIG, open(get_config_file_path(), 'w'))
 
+def write_config(updates: dict) -> None:
+    json.dump({**read_config(), **updates}, open(get_config_file_path(), 'w'))
+    config.update(updates)
+
 config = {**DEFAULT_CONFIG, **read_config()}
\ No newline at end of file
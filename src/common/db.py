@@ -1,7 +1,16 @@
-from pymongo import TEXT, MongoClient
+import os
+from datetime import datetime, timezone
+from threading import Lock
+
+from pymongo import TEXT, MongoClient, AsyncMongoClient, UpdateOne
+from pymongo.asynchronous.database import AsyncDatabase
 from pymongo.database import Database
 from pymongo.collation import Collation
-from chess import Move
+from chess import Move, WHITE, BLACK
+
+from .config import config
+
+MAX_SLICE = 2 ** 31 - 1
 
 def __setup_games(db: Database):
     db.games.create_index([
@@ -32,22 +41,205 @@ def __setup_db(db: Database) -> None:
     db.games_played_summary.create_index([
             ('username', TEXT)
          ], unique = True)
+    db.analysis_jobs.create_index([
+            ('status', 1),
+            ('lease_expires', 1)
+         ])
+    db.position_evaluations.create_index([
+            ('zobrist', 1),
+            ('search', 1),
+            ('move', 1)
+         ], unique = True)
+
+def __drop_text_indexes(collection) -> None:
+    for name, spec in collection.index_information().items():
+        if any(direction == TEXT for _, direction in spec['key']):
+            collection.drop_index(name)
+
+def __dedupe(collection, fields: list[str], rank) -> None:
+    duplicates = collection.aggregate([
+        {'$group': {
+            '_id': {field: f'${field}' for field in fields},
+            'ids': {'$push': '$_id'},
+            'count': {'$sum': 1}
+        }},
+        {'$match': {'count': {'$gt': 1}}}
+    ], allowDiskUse=True)
+    for duplicate in duplicates:
+        documents = list(collection.find({'_id': {'$in': duplicate['ids']}}))
+        # ties go to the newest _id so processes migrating together keep the same document
+        keep = max(documents, key=lambda document: (rank(document), document['_id']))
+        collection.delete_many({'_id': {'$in': [document['_id'] for document in documents if document is not keep]}})
+
+def __setup_btree_indexes(db: Database) -> None:
+    # unique indexes can only be built once duplicates are gone
+    __dedupe(db.games, ['hexdigest'], lambda game: len(game.get('tags', [])))
+    __dedupe(db.move_accuracy, ['hexdigest', 'username'],
+             lambda move_accuracy: (is_complete(move_accuracy), len(move_accuracy.get('move_accuracy', []))))
+    for collection in (db.games, db.move_accuracy, db.accuracy_per_square, db.games_played_summary):
+        __drop_text_indexes(collection)
+    db.games.create_index([('hexdigest', 1)], unique=True)
+    # player lookups are usually bounded by date as well
+    for player in ('headers.White', 'headers.Black'):
+        db.games.create_index([(player, 1), ('when', 1)], collation=collation())
+        if f'{player}_1' in db.games.index_information():
+            db.games.drop_index(f'{player}_1')
+    db.move_accuracy.create_index([
+            ('hexdigest', 1),
+            ('username', 1)
+         ], unique = True)
+    db.accuracy_per_square.create_index([
+            ('username', 1)
+         ], unique = True)
+    db.games_played_summary.create_index([
+            ('username', 1)
+         ], unique = True)
+
+def __setup_rollups(db: Database) -> None:
+    # older analyses never recorded when they finished, their _id is the closest thing
+    db.move_accuracy.update_many({
+            'complete': {'$ne': False},
+            'completed_at': {'$exists': False}
+        }, [{'$set': {'completed_at': {'$toDate': '$_id'}}}])
+    db.move_accuracy.create_index([
+            ('username', 1),
+            ('completed_at', 1),
+            ('_id', 1)
+         ])
+    db.accuracy_rollups.create_index([
+            ('username', 1)
+         ], unique = True)
+
+def __setup_best_games(db: Database) -> None:
+    db.games.update_many({
+            'white_accuracy': {'$exists': True},
+            'black_accuracy': {'$exists': True},
+            'accuracy': {'$exists': False}
+        }, [{'$set': {'accuracy': {'$avg': ['$white_accuracy', '$black_accuracy']}}}])
+    # a player's best games are a range scan from the top of the index
+    for player in ('headers.White', 'headers.Black'):
+        db.games.create_index([(player, 1), ('accuracy', -1)], collation=collation())
 
-def make_db(uri: str = 'mongodb://localhost:27017', db_name: str = 'chess-insights') -> Database:
-    client = MongoClient(uri)
-    db = client[db_name]
-    __setup_db(db)
+def __setup_accuracy_per_square_games(db: Database) -> None:
+    db.accuracy_per_square_games.create_index([
+            ('username', 1),
+            ('hexdigest', 1)
+         ], unique = True)
+
+# each entry upgrades the schema by one version, entries must be idempotent
+# because processes starting together may both apply the same one
+MIGRATIONS = [
+    __setup_db,
+    __setup_btree_indexes,
+    __setup_rollups,
+    __setup_best_games,
+    __setup_accuracy_per_square_games
+]
+
+clients = {}
+clients_lock = Lock()
+migrated = set()
+migrations_lock = Lock()
+
+def get_client(uri: str) -> MongoClient:
+    with clients_lock:
+        pid, client = clients.get(uri, (None, None))
+        # a client inherited through fork shares its sockets with the parent
+        if pid != os.getpid():
+            client = MongoClient(uri, maxPoolSize=config['db-pool-size'])
+            clients[uri] = (os.getpid(), client)
+        return client
+
+def migrate(db: Database) -> None:
+    schema = db.migrations.find_one({'_id': 'schema'}) or {'version': 0}
+    for version in range(schema['version'] + 1, len(MIGRATIONS) + 1):
+        MIGRATIONS[version - 1](db)
+        db.migrations.update_one({'_id': 'schema'}, {
+            '$set': {'version': version, 'migrated_at': datetime.now(timezone.utc)}
+        }, upsert=True)
+
+def make_db(uri: str = config['db-uri'], db_name: str = 'chess-insights') -> Database:
+    db = get_client(uri)[db_name]
+    with migrations_lock:
+        if (uri, db_name) not in migrated:
+            migrate(db)
+            migrated.add((uri, db_name))
     return db
 
+def close_db() -> None:
+    with clients_lock:
+        for pid, client in clients.values():
+            if pid == os.getpid():
+                client.close()
+        clients.clear()
+
+def make_async_db(uri: str = config['db-uri'], db_name: str = 'chess-insights') -> AsyncDatabase:
+    client = AsyncMongoClient(uri, maxPoolSize=config['db-pool-size'])
+    return client[db_name]
+
 def fetch_game_from_db(db: Database, hexdigest: str) -> dict:
     return db.games.find_one({'hexdigest': hexdigest})
 
+def is_complete(move_accuracy: dict) -> bool:
+    # documents written before checkpointing have no complete flag
+    return move_accuracy.get('complete') is not False
+
 def fetch_move_accuracy_from_db(db: Database, hexdigest: str, username: str) -> dict:
     move_accuracy = db.move_accuracy.find_one({
             'hexdigest': hexdigest, 
             'username': username
         })
-    return move_accuracy['move_accuracy'] if move_accuracy else None
+    return move_accuracy['move_accuracy'] if move_accuracy and is_complete(move_accuracy) else None
+
+def fetch_move_accuracy_progress(db: Database, hexdigest: str, username: str) -> tuple[list[float], bool]:
+    move_accuracy = db.move_accuracy.find_one({
+            'hexdigest': hexdigest,
+            'username': username
+        })
+    if not move_accuracy:
+        return [], False
+    return move_accuracy['move_accuracy'], is_complete(move_accuracy)
+
+def splice(field: str, offset: int, values: list) -> dict:
+    # overwrites positions offset.. and keeps the rest, so replaying a write changes nothing
+    current = {'$ifNull': [f'${field}', []]}
+    return {'$concatArrays': [
+        {'$slice': [current, offset]},
+        {'$literal': values},
+        {'$slice': [current, offset + len(values), MAX_SLICE]}
+    ]}
+
+def checkpoint_pipeline(offset: int, scored: list[float], budgets: list[float], complete: bool) -> list[dict]:
+    fields = {
+        'move_accuracy': splice('move_accuracy', offset, scored),
+        'search_budget': splice('search_budget', offset, budgets),
+        # a late partial write from another worker must not reopen a finished analysis
+        'complete': {'$or': [{'$eq': ['$complete', True]}, complete]}
+    }
+    if complete:
+        # stamped by the server when the write lands, rollup watermarks rely on it
+        fields['completed_at'] = {'$ifNull': ['$completed_at', '$$NOW']}
+    return [{'$set': fields}]
+
+def checkpoint_move_accuracy(hexdigest: str, username: str, offset: int, scored: list[float],
+                             budgets: list[float], complete: bool) -> UpdateOne:
+    return UpdateOne({
+            'hexdigest': hexdigest,
+            'username': username
+        }, checkpoint_pipeline(offset, scored, budgets, complete), upsert=True)
+
+def store_game_accuracies(db: Database, hexdigest: str, accuracies: dict[bool, float]) -> None:
+    result = db.games.update_one({'hexdigest': hexdigest},
+                            {
+                                '$set': {
+                                    'white_accuracy': accuracies[WHITE],
+                                    'black_accuracy' : accuracies[BLACK],
+                                    'accuracy': (accuracies[WHITE] + accuracies[BLACK]) / 2
+                                    },
+                                '$addToSet': { 'tags': 'best_games'}
+                         })
+    if result.matched_count != 1:
+        raise AttributeError(f'Game {hexdigest} was not updated, with this game_accuracy pair: {accuracies}')
 
 def collation():
     return Collation(locale='en', strength=2)
\ No newline at end of file
@@ -1,15 +1,92 @@
-from chess.engine import SimpleEngine, Limit
+import math
+from argparse import Namespace
+from contextlib import contextmanager
+from threading import local
 
-from .remote_engine import make_remote, is_remote_available
+from chess.engine import SimpleEngine, Limit, BaseCommand, UciProtocol, popen_uci
+
+from .remote_engine import make_remote, acquire_remote
 from .config import config
 
+class UciNewGameCommand(BaseCommand[None]):
+    def __init__(self, engine: UciProtocol):
+        super().__init__(engine)
+        self.engine = engine
+
+    def start(self) -> None:
+        self.engine.send_line('ucinewgame')
+        self.result.set_result(None)
+        self.set_finished()
+
 def make_engine() -> tuple[SimpleEngine, str]:
-    can_remote = is_remote_available()
-    if can_remote:
-        return make_remote()
+    remote = acquire_remote()
+    if remote:
+        engine, remote = make_remote(remote)
+        if engine is not None:
+            return engine, remote
+    return make_local_engine(), None
+
+def engine_options(threads: int = None, hash_mb: int = None) -> dict:
+    return {
+        'Threads': threads or config['engine-threads'],
+        'Hash': hash_mb or config['engine-hash-mb'],
+        'SyzygyPath': config['syzygy-path']
+    }
+
+def make_local_engine(threads: int = None, hash_mb: int = None) -> SimpleEngine:
     engine = SimpleEngine.popen_uci('stockfish', setpgrp=True)
-    engine.configure({'Threads': 2, 'SyzygyPath': './3-4-5'})
-    return engine, None
+    engine.configure(engine_options(threads, hash_mb))
+    return engine
+
+async def make_async_engine() -> UciProtocol:
+    _, protocol = await popen_uci('stockfish', setpgrp=True)
+    await protocol.configure(engine_options())
+    return protocol
+
+def new_game(engine: SimpleEngine) -> None:
+    engine.communicate(UciNewGameCommand)
+    engine.ping()
+
+def configure_search_limit(args: Namespace) -> None:
+    if getattr(args, 'search_nodes', None):
+        config['search-nodes'] = args.search_nodes
+    if getattr(args, 'search_depth', None):
+        config['search-depth'] = args.search_depth
+    if getattr(args, 'budget_policy', None):
+        config['budget-policy'] = args.budget_policy
+
+search_limit_override = local()
+
+def search_limit() -> dict:
+    override = getattr(search_limit_override, 'value', None)
+    return override or {'search-nodes': config['search-nodes'], 'search-depth': config['search-depth']}
+
+@contextmanager
+def searching_with(limit_settings: dict):
+    # per thread, so jobs with different limits can share a worker
+    search_limit_override.value = limit_settings
+    try:
+        yield
+    finally:
+        search_limit_override.value = None
+
+def scaled_depth(factor: float) -> int:
+    # each doubling of the budget buys roughly one more ply
+    return max(1, search_limit()['search-depth'] + round(math.log2(factor)))
+
+def limit(factor: float = 1) -> Limit:
+    if search_limit()['search-nodes']:
+        return Limit(nodes=max(1, round(search_limit()['search-nodes'] * factor)))
+    if search_limit()['search-depth']:
+        return Limit(depth=scaled_depth(factor))
+    return Limit(time=config['think-time-seconds'] * factor)
+
+def limit_key(factor: float = 1) -> str:
+    if search_limit()['search-nodes']:
+        return f"nodes={max(1, round(search_limit()['search-nodes'] * factor))}"
+    if search_limit()['search-depth']:
+        return f"depth={scaled_depth(factor)}"
+    return f"time={config['think-time-seconds'] * factor}"
 
-def limit() -> Limit:
-    return Limit(time=config['think-time-seconds'])
+def is_deterministic_limit() -> bool:
+    return bool(search_limit()['search-nodes'] or search_limit()['search-depth'])
@@ -0,0 +1,87 @@
+from contextlib import contextmanager
+from queue import Queue
+from threading import Lock
+from typing import Generator
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from chess.engine import SimpleEngine, EngineError
+
+from .engine import make_engine, new_game
+from .remote_engine import set_remote_available
+
+ENGINE_FAILURES = (EngineError, FutureTimeoutError, TimeoutError)
+
+class EnginePool:
+    def __init__(self):
+        self.size = 0
+        self.idle = Queue()
+        self.lock = Lock()
+
+    def grow(self, size: int) -> None:
+        with self.lock:
+            while self.size < size:
+                # slots are started on their first lease
+                self.idle.put((None, None))
+                self.size += 1
+
+    def checkout(self) -> tuple[SimpleEngine, str]:
+        engine, remote = self.idle.get()
+        try:
+            return self.prepare(engine, remote)
+        except BaseException:
+            self.idle.put((None, None))
+            raise
+
+    def checkin(self, engine: SimpleEngine, remote: str, failed: bool = False) -> None:
+        if failed:
+            self.discard(engine, remote)
+            engine, remote = None, None
+        self.idle.put((engine, remote))
+
+    @contextmanager
+    def lease(self) -> Generator[SimpleEngine, None, None]:
+        engine, remote = self.checkout()
+        failed = False
+        try:
+            yield engine
+        except ENGINE_FAILURES:
+            failed = True
+            raise
+        finally:
+            self.checkin(engine, remote, failed)
+
+    def prepare(self, engine: SimpleEngine, remote: str) -> tuple[SimpleEngine, str]:
+        if engine is not None:
+            try:
+                new_game(engine)
+                return engine, remote
+            except ENGINE_FAILURES:
+                self.discard(engine, remote)
+        return make_engine()
+
+    def discard(self, engine: SimpleEngine, remote: str) -> None:
+        if engine is not None:
+            engine.close()
+        if remote:
+            set_remote_available(remote, True)
+
+    def close(self) -> None:
+        with self.lock:
+            for _ in range(self.size):
+                engine, remote = self.idle.get()
+                if engine is not None:
+                    try:
+                        engine.quit()
+                    except ENGINE_FAILURES:
+                        pass
+                self.discard(engine, remote)
+            self.size = 0
+
+engine_pool = EnginePool()
+
+def get_engine_pool(size: int = 1) -> EnginePool:
+    engine_pool.grow(size)
+    return engine_pool
+
+def close_engine_pool() -> None:
+    engine_pool.close()
@@ -0,0 +1,83 @@
+from collections import OrderedDict, Counter
+from threading import Lock
+from typing import Optional
+
+from chess import Board, Move
+from chess.polyglot import zobrist_hash
+from pymongo import UpdateOne
+from pymongo.database import Database
+
+from .config import config
+from .engine import limit_key, is_deterministic_limit
+from .stats import increment, register_reporter
+
+def position_key(board: Board) -> int:
+    key = zobrist_hash(board)
+    # stored as a signed 64 bit integer so it fits a BSON long
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+def search_key(ranking_mode: str, factor: float = 1) -> str:
+    return f'{ranking_mode}/{limit_key(factor)}'
+
+class EvaluationCache:
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get_many(self, db: Database, board: Board, moves: list[Move], search: str) -> dict[Move, float]:
+        position = position_key(board)
+        move_values = {}
+        with self.lock:
+            for move in moves:
+                key = (position, move.uci(), search)
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    move_values[move] = self.entries[key]
+        increment('eval-cache-memory-hits', len(move_values))
+        missing = {move.uci(): move for move in moves if move not in move_values}
+        if missing and db is not None and is_deterministic_limit():
+            stored = db.position_evaluations.find({
+                    'zobrist': position,
+                    'search': search,
+                    'move': {'$in': list(missing)}
+                }, {'_id': 0, 'move': 1, 'value': 1})
+            stored_values = {missing[document['move']]: document['value'] for document in stored}
+            increment('eval-cache-db-hits', len(stored_values))
+            self.remember(position, stored_values, search)
+            move_values.update(stored_values)
+        increment('eval-cache-misses', len(moves) - len(move_values))
+        return move_values
+
+    def put_many(self, db: Database, board: Board, move_values: dict[Move, float], search: str) -> None:
+        position = position_key(board)
+        self.remember(position, move_values, search)
+        if not move_values or db is None or not is_deterministic_limit():
+            return
+        db.position_evaluations.bulk_write([
+            UpdateOne({
+                    'zobrist': position,
+                    'search': search,
+                    'move': move.uci()
+                }, {'$setOnInsert': {'value': value}}, upsert=True)
+            for move, value in move_values.items()
+        ], ordered=False)
+
+    def remember(self, position: int, move_values: dict[Move, float], search: str) -> None:
+        with self.lock:
+            for move, value in move_values.items():
+                self.entries[(position, move.uci(), search)] = value
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+def format_cache_stats(counters: Counter) -> Optional[str]:
+    hits = counters['eval-cache-memory-hits'] + counters['eval-cache-db-hits']
+    lookups = hits + counters['eval-cache-misses']
+    if not lookups:
+        return None
+    return (f'Evaluation cache: {hits} hits ({counters["eval-cache-memory-hits"]} memory, '
+            f'{counters["eval-cache-db-hits"]} db), {counters["eval-cache-misses"]} misses, '
+            f'{hits/lookups*100:.2f}% hit rate')
+
+eval_cache = EvaluationCache(config['eval-cache-size'])
+register_reporter(format_cache_stats)
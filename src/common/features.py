@@ -0,0 +1,82 @@
+from io import StringIO
+
+import numpy as np
+from bson import Binary
+from chess import WHITE, KING
+from chess.pgn import read_game, Game
+from pymongo import UpdateOne
+from pymongo.database import Database
+
+FEATURES_VERSION = 1
+FEATURE_DTYPES = {
+    # from square | to square << 6 | promotion piece type << 12
+    'moves': np.uint16,
+    'pieces': np.uint8,
+    'to_squares': np.uint8,
+    'captures': np.uint8,
+    'sides': np.uint8
+}
+PIECE_SYMBOLS = ' PNBRQK'
+
+def extract_features(game: Game) -> dict:
+    plies = {name: [] for name in FEATURE_DTYPES}
+    board = game.board()
+    for move in game.mainline_moves():
+        plies['moves'].append(move.from_square | move.to_square << 6 | (move.promotion or 0) << 12)
+        plies['pieces'].append(board.piece_type_at(move.from_square))
+        plies['to_squares'].append(move.to_square)
+        plies['captures'].append(board.is_capture(move))
+        plies['sides'].append(board.turn == WHITE)
+        board.push(move)
+    features = {name: Binary(np.array(values, dtype=FEATURE_DTYPES[name]).tobytes())
+                for name, values in plies.items()}
+    features['version'] = FEATURES_VERSION
+    return features
+
+def extract_features_from_pgn(pgn: str) -> dict:
+    return extract_features(read_game(StringIO(pgn)))
+
+def decode_features(features: dict) -> dict[str, np.ndarray]:
+    return {name: np.frombuffer(features[name], dtype=dtype) for name, dtype in FEATURE_DTYPES.items()}
+
+def features_update(game_document: dict) -> UpdateOne:
+    return UpdateOne({'_id': game_document['_id']},
+                     {'$set': {'features': extract_features_from_pgn(game_document['pgn'])}})
+
+def has_current_features(game_document: dict) -> bool:
+    features = game_document.get('features')
+    return bool(features) and features['version'] == FEATURES_VERSION
+
+def fill_missing_features(db: Database, game_documents: list[dict]) -> None:
+    # games ingested before features existed are filled in on first use, a batch at a time;
+    # backfill_features does all of them up front
+    stale = [game_document for game_document in game_documents if not has_current_features(game_document)]
+    if not stale:
+        return
+    pgns = {document['_id']: document['pgn']
+            for document in db.games.find({'_id': {'$in': [game_document['_id'] for game_document in stale]}},
+                                          {'pgn': 1})}
+    for game_document in stale:
+        game_document['features'] = extract_features_from_pgn(pgns[game_document['_id']])
+    db.games.bulk_write([UpdateOne({'_id': game_document['_id']}, {'$set': {'features': game_document['features']}})
+                         for game_document in stale], ordered=False)
+
+def get_game_features(db: Database, game_document: dict) -> dict[str, np.ndarray]:
+    fill_missing_features(db, [game_document])
+    return decode_features(game_document['features'])
+
+def user_plies(features: dict[str, np.ndarray], headers: dict, username: str) -> np.ndarray:
+    # usernames match case-insensitively, like the games collation
+    return features['sides'] == (headers['White'].lower() == username.lower())
+
+def piece_symbols(features: dict[str, np.ndarray]) -> np.ndarray:
+    symbols = np.array(list(PIECE_SYMBOLS), dtype=object)[features['pieces']]
+    from_files = features['moves'] & 7
+    to_files = features['to_squares'] & 7
+    castles = (features['pieces'] == KING) & (np.abs(to_files.astype(int) - from_files.astype(int)) == 2)
+    symbols[castles & (to_files > from_files)] = 'OO'
+    symbols[castles & (to_files < from_files)] = 'OOO'
+    return symbols
+
+def destination_coords(features: dict[str, np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    return features['to_squares'] % 8, features['to_squares'] // 8
@@ -0,0 +1,137 @@
+import os
+import socket
+from datetime import datetime, timedelta, timezone
+from threading import Event, Lock, Thread
+from typing import Optional
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.database import Database
+
+from .config import config
+from .engine import limit_key, search_limit
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+def make_worker_id() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+def game_job(hexdigest: str, players: dict[str, str], ranking_mode: str) -> dict:
+    sides = '+'.join(sorted(players))
+    return {
+        '_id': f'game:{hexdigest}:{sides}:{ranking_mode}',
+        'kind': 'game',
+        'hexdigest': hexdigest,
+        'players': players,
+        'ranking_mode': ranking_mode
+    }
+
+def position_job(position: int, fen: str, ranking_mode: str) -> dict:
+    # evaluations are only worth queueing under the limit the producer reads them back with
+    return {
+        '_id': f'position:{position}:{ranking_mode}:{limit_key()}',
+        'kind': 'position',
+        'fen': fen,
+        'ranking_mode': ranking_mode,
+        'search_limit': search_limit()
+    }
+
+def enqueue_jobs(db: Database, jobs: list[dict]) -> int:
+    if not jobs:
+        return 0
+    now = datetime.now(timezone.utc)
+    result = db.analysis_jobs.bulk_write([
+        UpdateOne({'_id': job['_id']}, {'$setOnInsert': {
+                **{key: value for key, value in job.items() if key != '_id'},
+                'status': QUEUED,
+                'attempts': 0,
+                'created': now
+            }}, upsert=True)
+        for job in jobs
+    ], ordered=False)
+    return result.upserted_count
+
+def fail_abandoned_jobs(db: Database, now: datetime) -> None:
+    # a job that kills its worker never reaches fail_job, its expired leases are counted instead
+    db.analysis_jobs.update_many({
+            'status': RUNNING,
+            'lease_expires': {'$lt': now},
+            'attempts': {'$gte': config['job-max-attempts']}
+        }, {
+            '$set': {'status': FAILED, 'error': 'lease expired on the last attempt'},
+            '$unset': {'lease_expires': ''}
+        })
+
+def claim_job(db: Database, worker_id: str) -> Optional[dict]:
+    now = datetime.now(timezone.utc)
+    fail_abandoned_jobs(db, now)
+    return db.analysis_jobs.find_one_and_update({
+            '$or': [
+                {'status': QUEUED},
+                {'status': RUNNING, 'lease_expires': {'$lt': now}, 'attempts': {'$lt': config['job-max-attempts']}}
+            ]
+        }, {
+            '$set': {
+                'status': RUNNING,
+                'worker': worker_id,
+                'lease_expires': now + timedelta(seconds=config['job-lease-seconds'])
+            },
+            '$inc': {'attempts': 1}
+        }, return_document=ReturnDocument.AFTER)
+
+def owned(job: dict) -> dict:
+    # a worker whose lease expired must not touch the job once someone else claimed it
+    return {'_id': job['_id'], 'worker': job['worker'], 'status': RUNNING}
+
+def complete_job(db: Database, job: dict) -> None:
+    db.analysis_jobs.update_one(owned(job), {
+            '$set': {'status': DONE, 'finished': datetime.now(timezone.utc)},
+            '$unset': {'lease_expires': ''}
+        })
+
+def fail_job(db: Database, job: dict, error: str) -> None:
+    status = FAILED if job['attempts'] >= config['job-max-attempts'] else QUEUED
+    db.analysis_jobs.update_one(owned(job), {
+            '$set': {'status': status, 'error': error},
+            '$unset': {'lease_expires': ''}
+        })
+
+def count_jobs_by_status(db: Database) -> dict[str, int]:
+    return {
+        group['_id']: group['count']
+        for group in db.analysis_jobs.aggregate([{'$group': {'_id': '$status', 'count': {'$sum': 1}}}])
+    }
+
+class Heartbeat(Thread):
+    def __init__(self, db: Database, worker_id: str):
+        super().__init__(daemon=True)
+        self.db = db
+        self.worker_id = worker_id
+        self.job_ids = set()
+        self.lock = Lock()
+        self.stopped = Event()
+
+    def add(self, job_id: str) -> None:
+        with self.lock:
+            self.job_ids.add(job_id)
+
+    def remove(self, job_id: str) -> None:
+        with self.lock:
+            self.job_ids.discard(job_id)
+
+    def run(self) -> None:
+        lease = config['job-lease-seconds']
+        while not self.stopped.wait(lease / 3):
+            with self.lock:
+                job_ids = list(self.job_ids)
+            if job_ids:
+                self.db.analysis_jobs.update_many({
+                        '_id': {'$in': job_ids},
+                        'worker': self.worker_id,
+                        'status': RUNNING
+                    }, {'$set': {'lease_expires': datetime.now(timezone.utc) + timedelta(seconds=lease)}})
+
+    def stop(self) -> None:
+        self.stopped.set()
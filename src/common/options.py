@@ -1,5 +1,7 @@
 import sys
-from common.util import PIECES_STR
+from common.util import PIECES_STR, RANKING_MODES, COUNT_MODES
+from common.config import config
+from common.budget import BUDGET_POLICIES
 from datetime import datetime
 
 def username_option(parser, required=True):
@@ -27,14 +29,47 @@ def limit_option(parser):
         help='limit of games to handle'
     )
 
+def count_mode_option(parser):
+    parser.add_argument(
+        '--count-mode',
+        default='exact',
+        choices=COUNT_MODES,
+        help='how the progress bar total is found: an exact count, a time-boxed count or none at all'
+    )
+
+def aggregate_option(parser):
+    parser.add_argument(
+        '--aggregate',
+        action='store_true',
+        help='groups the headers on the database server instead of reading every game'
+    )
+
+def rollup_option(parser):
+    parser.add_argument(
+        '--rollup',
+        action='store_true',
+        help='reads the per-user rollup, refreshed with newly analysed games; only the color filter applies'
+    )
+
 def worker_count_option(parser):
     parser.add_argument(
         '-w',
         '--worker-count',
-        default=4,
+        default=config['worker-count'],
         type=int,
         help='how many workers to have running concurrently'
     )
+    parser.add_argument(
+        '--auto-tune',
+        action='store_true',
+        help='measure the split of workers, engine threads and hash that analyses the most positions per second on this machine and save it to the config'
+    )
+    parser.add_argument(
+        '--auto-tune-seconds',
+        default=config['auto-tune-seconds'],
+        type=float,
+        help='how long to calibrate each candidate split'
+    )
 
 def remote_engines_option(parser):
     parser.add_argument(
@@ -42,7 +77,92 @@ def remote_engines_option(parser):
         '--remote-engines',
         default=[],
         nargs='*',
-        help='use a remote engine in addition to local engines (format: USER@ADDRESS)'
+        help='use remote engines in addition to local engines (format: USER@ADDRESS or tcp://HOST:PORT, append *N for N engines)'
+    )
+
+def ranking_mode_option(parser):
+    parser.add_argument(
+        '--ranking-mode',
+        default=config['ranking-mode'],
+        choices=list(RANKING_MODES),
+        help='how legal moves are scored: one search per move or a single MultiPV search'
+    )
+
+def search_limit_options(parser):
+    parser.add_argument(
+        '--search-nodes',
+        type=int,
+        help='search a fixed number of nodes per position instead of a fixed time'
+    )
+    parser.add_argument(
+        '--search-depth',
+        type=int,
+        help='search to a fixed depth per position instead of a fixed time'
+    )
+    parser.add_argument(
+        '--budget-policy',
+        default=config['budget-policy'],
+        choices=list(BUDGET_POLICIES),
+        help='spend the same search on every position or start cheap and search deeper only while the played move\'s rank is uncertain'
+    )
+
+def warm_cache_options(parser):
+    parser.add_argument(
+        '--warm-cache',
+        action='store_true',
+        help='count repeated positions across the selected games and analyse the frequent ones up front'
+    )
+    parser.add_argument(
+        '--warm-min-count',
+        type=int,
+        default=2,
+        help='how many times a position must occur to be warmed'
+    )
+    parser.add_argument(
+        '--plan-only',
+        action='store_true',
+        help='only report how much the selected games deduplicate, without analysing them'
+    )
+
+def pipeline_option(parser):
+    parser.add_argument(
+        '--pipeline',
+        default='threads',
+        choices=['threads', 'asyncio'],
+        help='run blocking engines on a thread pool or drive local engines from one event loop (asyncio does not support --remote-engines)'
+    )
+
+def approximate_options(parser):
+    parser.add_argument(
+        '--approximate',
+        action='store_true',
+        help='analyse games in random order and stop once the estimate is within --error-bound or --time-budget is spent'
+    )
+    parser.add_argument(
+        '--error-bound',
+        type=float,
+        help='stop when the confidence interval half-width drops below this, e.g. 0.01 for +-1%%'
+    )
+    parser.add_argument(
+        '--time-budget',
+        type=float,
+        help='stop after this many seconds'
+    )
+    parser.add_argument(
+        '--confidence',
+        type=float,
+        default=0.95,
+        help='confidence level of the reported interval'
+    )
+    parser.add_argument(
+        '--sample-plies',
+        type=int,
+        help='score only this many random plies of games that were not analysed before'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        help='seed for ply sampling'
     )
 
 def pieces_option(parser):
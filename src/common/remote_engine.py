@@ -1,20 +1,30 @@
+import sys
+import time
 from threading import Lock
-from chess.engine import SimpleEngine
+from typing import Optional
+from chess.engine import SimpleEngine, EngineError
+
+from .config import config
+from .tcp_engine import connect_tcp_engine
 
 remote_lock = {}
 REMOTES = []
 
 def add_remotes(remotes: list[str]):
+    # USER@ADDRESS or tcp://HOST:PORT, optionally suffixed with *N for N engines
     for remote in remotes:
-        remote_lock[remote] = Lock()
+        address, _, count = remote.partition('*')
+        for slot in range(int(count or 1)):
+            remote_lock[f'{address}#{slot}'] = Lock()
 
-def get_remote_available() -> bool:
-    for remote, lock in remote_lock.items():
-       if not lock.locked():
-           return remote
+def remote_address(remote: str) -> str:
+    return remote.partition('#')[0]
 
-def is_remote_available() -> bool:
-    return bool(get_remote_available())
+def acquire_remote() -> Optional[str]:
+    for remote, lock in remote_lock.items():
+        if lock.acquire(blocking=False):
+            return remote
+    return None
 
 def set_remote_available(remote: str, availability: bool) -> None:
     if availability:
@@ -22,9 +32,24 @@ def set_remote_available(remote: str, availability: bool) -> None:
     else:
         remote_lock[remote].acquire()
 
-def make_remote() -> tuple[SimpleEngine, bool]:
-    remote = get_remote_available()
-    set_remote_available(remote, False)
-    engine = SimpleEngine.popen_uci(['ssh', remote, 'stockfish'])
-    engine.configure({'Threads': 2, 'Hash': 32})
-    return engine, remote
+def open_remote(remote: str) -> SimpleEngine:
+    address = remote_address(remote)
+    if address.startswith('tcp://'):
+        return connect_tcp_engine(address)
+    return SimpleEngine.popen_uci(['ssh', address, 'stockfish'])
+
+def make_remote(remote: str) -> tuple[SimpleEngine, str]:
+    for attempt in range(config['remote-connect-attempts']):
+        engine = None
+        try:
+            engine = open_remote(remote)
+            engine.configure({'Threads': config['remote-engine-threads'], 'Hash': config['remote-engine-hash-mb']})
+            return engine, remote
+        except (OSError, TimeoutError, EngineError) as e:
+            if engine is not None:
+                engine.close()
+            print(f'Could not reach {remote_address(remote)}: {e}', file=sys.stderr)
+            if attempt < config['remote-connect-attempts'] - 1:
+                time.sleep(2 ** attempt)
+    set_remote_available(remote, True)
+    return None, None
@@ -0,0 +1,51 @@
+from abc import ABC, abstractmethod
+from argparse import Namespace
+from functools import cache
+from typing import Any, Callable
+
+import numpy as np
+from pymongo.database import Database
+from tqdm import tqdm
+
+from .features import get_game_features
+from .util import make_game_generator, count_user_games
+
+class Report(ABC):
+    fields: list[str] = []
+    with_move_accuracy = False
+
+    def __init__(self, args: Namespace):
+        self.username = args.username
+
+    def start(self, db: Database, args: Namespace) -> None:
+        pass
+
+    @abstractmethod
+    def add(self, game_document: dict, features: Callable[[], dict[str, np.ndarray]]) -> None:
+        pass
+
+    @abstractmethod
+    def finish(self, db: Database, args: Namespace) -> Any:
+        pass
+
+def merge_fields(reports: list[Report]) -> list[str]:
+    fields = {field for report in reports for field in report.fields}
+    # mongodb rejects projections where one path is a prefix of another
+    return sorted(field for field in fields
+                  if not any(field.startswith(f'{other}.') for other in fields))
+
+def run_reports(db: Database, args: Namespace, reports: dict[str, Report]) -> dict[str, Any]:
+    for report in reports.values():
+        report.start(db, args)
+    with_move_accuracy = any(report.with_move_accuracy for report in reports.values())
+    fields = merge_fields(list(reports.values()))
+    game_generator = make_game_generator(db, args, fields, with_move_accuracy, 'features' in fields)
+    for game_document in tqdm(game_generator, total=count_user_games(db, args)):
+        # decoded at most once per game, and only if some report asks for it
+        features = cache(lambda game_document=game_document: get_game_features(db, game_document))
+        for report in reports.values():
+            report.add(game_document, features)
+    return {name: report.finish(db, args) for name, report in reports.items()}
+
+def run_report(db: Database, args: Namespace, report: Report) -> Any:
+    return run_reports(db, args, {'report': report})['report']
@@ -0,0 +1,97 @@
+from argparse import Namespace
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Optional
+
+from chess import WHITE, BLACK
+from pymongo.database import Database
+
+from .features import get_game_features, fill_missing_features, user_plies, piece_symbols
+from .util import color_as_string, make_projection
+
+# completed_at is the server time of the write, an analysis stamped just before
+# a refresh may still be invisible to it, so the newest ones wait for the next
+SETTLE_SECONDS = 60
+ROLLUP_BATCH_SIZE = 500
+ROLLUP_FIELDS = ['headers.ECO', 'headers.White', 'headers.TimeControl', 'features']
+
+def empty_rollup(username: str) -> dict:
+    return {
+        'username': username,
+        'watermark': None,
+        'openings': {},
+        'pieces': {},
+        'colors': {},
+        'time_controls': {}
+    }
+
+def fetch_rollup(db: Database, username: str) -> dict:
+    return db.accuracy_rollups.find_one({'username': username}) or empty_rollup(username)
+
+def accumulate(entries: dict, key: str, total: float, count: int) -> None:
+    entry = entries.setdefault(key, {'sum': 0, 'count': 0})
+    entry['sum'] += total
+    entry['count'] += count
+
+def absorb(rollup: dict, game_document: dict, features: dict, move_accuracy: list[float], username: str) -> None:
+    headers = game_document['headers']
+    color = color_as_string(headers['White'].lower() == username.lower())
+    game_accuracy = sum(move_accuracy)/len(move_accuracy)
+    if 'ECO' in headers:
+        accumulate(rollup['openings'].setdefault(color, {}), headers['ECO'], game_accuracy, 1)
+    accumulate(rollup['time_controls'].setdefault(color, {}), headers.get('TimeControl', '-'), game_accuracy, 1)
+    accumulate(rollup['colors'], color, sum(move_accuracy), len(move_accuracy))
+    symbols = piece_symbols(features)[user_plies(features, headers, username)]
+    for symbol, accuracy in zip(symbols, move_accuracy):
+        accumulate(rollup['pieces'].setdefault(color, {}), symbol, accuracy, 1)
+
+def new_analyses(db: Database, username: str, watermark: Optional[dict], settled_before: datetime):
+    _filter = {
+        'username': username,
+        'complete': {'$ne': False},
+        'completed_at': {'$lt': settled_before}
+    }
+    if watermark:
+        _filter['$or'] = [
+            {'completed_at': {'$gt': watermark['completed_at']}},
+            {'completed_at': watermark['completed_at'], '_id': {'$gt': watermark['_id']}}
+        ]
+    return db.move_accuracy.find(_filter, {'hexdigest': 1, 'move_accuracy': 1, 'completed_at': 1}) \
+        .sort([('completed_at', 1), ('_id', 1)])
+
+def refresh_rollup(db: Database, username: str) -> dict:
+    rollup = fetch_rollup(db, username)
+    watermark = rollup['watermark']
+    # the cutoff comes from the same clock that stamped completed_at
+    settled_before = db.command('hello')['localTime'] - timedelta(seconds=SETTLE_SECONDS)
+    cursor = new_analyses(db, username, watermark, settled_before)
+    try:
+        while chunk := list(islice(cursor, ROLLUP_BATCH_SIZE)):
+            game_documents = db.games.find({
+                    'hexdigest': {'$in': [analysis['hexdigest'] for analysis in chunk]},
+                    'invalid': {'$exists': False}
+                }, make_projection(ROLLUP_FIELDS))
+            by_hexdigest = {game_document['hexdigest']: game_document for game_document in game_documents}
+            fill_missing_features(db, list(by_hexdigest.values()))
+            for analysis in chunk:
+                game_document = by_hexdigest.get(analysis['hexdigest'])
+                if game_document and analysis['move_accuracy']:
+                    absorb(rollup, game_document, get_game_features(db, game_document),
+                           analysis['move_accuracy'], username)
+            rollup['watermark'] = {'completed_at': chunk[-1]['completed_at'], '_id': chunk[-1]['_id']}
+    finally:
+        cursor.close()
+    if rollup['watermark'] != watermark:
+        db.accuracy_rollups.replace_one({'username': username}, rollup, upsert=True)
+    return rollup
+
+def rollup_colors(args: Namespace) -> list[str]:
+    colors = [WHITE, BLACK] if args.color is None else [args.color]
+    return [color_as_string(color) for color in colors]
+
+def rollup_means(rollup: dict, dimension: str, colors: list[str]) -> dict[str, float]:
+    totals = {}
+    for color in colors:
+        for key, entry in rollup[dimension].get(color, {}).items():
+            accumulate(totals, key, entry['sum'], entry['count'])
+    return {key: total['sum']/total['count'] for key, total in totals.items() if total['count']}
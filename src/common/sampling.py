@@ -0,0 +1,48 @@
+import math
+import time
+from statistics import NormalDist
+from threading import Lock
+from typing import Optional
+
+# below this many samples the normal approximation is not trusted
+MIN_SAMPLES = 30
+
+class RunningEstimate:
+    def __init__(self, population: int, confidence: float):
+        self.population = population
+        self.z = NormalDist().inv_cdf((1 + confidence) / 2)
+        self.count = 0
+        self.mean = 0.0
+        self.squared_deviations = 0.0
+        self.lock = Lock()
+
+    def add(self, value: float) -> None:
+        # Welford's online mean and variance
+        with self.lock:
+            self.count += 1
+            delta = value - self.mean
+            self.mean += delta / self.count
+            self.squared_deviations += delta * (value - self.mean)
+
+    def half_width(self) -> float:
+        if self.count < 2:
+            return math.inf
+        if self.count >= self.population:
+            return 0.0
+        variance = self.squared_deviations / (self.count - 1)
+        # games are drawn without replacement from a known population
+        correction = math.sqrt((self.population - self.count) / (self.population - 1))
+        return self.z * math.sqrt(variance / self.count) * correction
+
+class StoppingRule:
+    def __init__(self, estimate: RunningEstimate, error_bound: Optional[float], time_budget: Optional[float]):
+        self.estimate = estimate
+        self.error_bound = error_bound
+        self.deadline = None if time_budget is None else time.monotonic() + time_budget
+
+    def reached(self) -> bool:
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return True
+        if self.error_bound is None or self.estimate.count < min(MIN_SAMPLES, self.estimate.population):
+            return False
+        return self.estimate.half_width() <= self.error_bound
@@ -0,0 +1,59 @@
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from threading import Event, Semaphore, Thread
+from typing import Any, Callable, Iterable, Optional
+
+ITEM = 'item'
+DONE = 'done'
+FAILED = 'failed'
+EXHAUSTED = 'exhausted'
+
+def run_bounded(items: Iterable[Any], task: Callable[[Any], Any],
+                on_result: Callable[[Any, Any], None], worker_count: int,
+                backlog: Optional[int] = None) -> None:
+    # items are pulled lazily and at most worker_count + backlog of them are in
+    # flight; results are handed to on_result on the calling thread as they complete
+    max_pending = worker_count + (worker_count if backlog is None else backlog)
+    events = Queue()
+    slots = Semaphore(max_pending)
+    stopped = Event()
+    def feed() -> None:
+        # a producer may block waiting for work, so it runs on its own thread
+        # and finished items are still handled in the meantime
+        try:
+            iterator = iter(items)
+            while slots.acquire() and not stopped.is_set():
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                events.put((ITEM, item, None))
+        except BaseException as e: # pylint: disable=W0718
+            events.put((FAILED, e, None))
+            return
+        events.put((EXHAUSTED, None, None))
+    executor = ThreadPoolExecutor(max_workers=worker_count)
+    Thread(target=feed, daemon=True).start()
+    pending = 0
+    exhausted = False
+    try:
+        while not exhausted or pending > 0:
+            kind, value, future = events.get()
+            if kind == ITEM:
+                pending += 1
+                executor.submit(task, value).add_done_callback(
+                    lambda future, item=value: events.put((DONE, item, future)))
+            elif kind == DONE:
+                pending -= 1
+                slots.release()
+                on_result(value, future.result())
+            elif kind == FAILED:
+                raise value
+            else:
+                exhausted = True
+    except BaseException:
+        stopped.set()
+        slots.release()
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    executor.shutdown(wait=True)
@@ -0,0 +1,24 @@
+import sys
+from collections import Counter
+from threading import Lock
+from typing import Callable, Optional
+
+counters = Counter()
+counters_lock = Lock()
+reporters = []
+
+def increment(name: str, amount: int = 1) -> None:
+    with counters_lock:
+        counters[name] += amount
+
+def register_reporter(reporter: Callable[[Counter], Optional[str]]) -> None:
+    reporters.append(reporter)
+
+def report_stats() -> None:
+    with counters_lock:
+        snapshot = Counter(counters)
+        counters.clear()
+    for reporter in reporters:
+        line = reporter(snapshot)
+        if line:
+            print(line, file=sys.stderr)
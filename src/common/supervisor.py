@@ -0,0 +1,160 @@
+import asyncio
+import sys
+import time
+from collections import Counter
+from threading import Lock
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from chess import Board
+from chess.engine import SimpleEngine, UciProtocol
+from pymongo.database import Database
+
+from .config import config
+from .engine import make_async_engine
+from .engine_pool import EnginePool, ENGINE_FAILURES
+from .eval_cache import position_key
+from .stats import increment, register_reporter
+
+T = TypeVar('T')
+
+MAX_BACKOFF_SECONDS = 30
+
+# long running workers pick up released positions within this long
+QUARANTINE_REFRESH_SECONDS = 60
+
+quarantined_keys = None
+quarantine_loaded_at = 0
+quarantine_lock = Lock()
+
+class PositionQuarantined(Exception):
+    pass
+
+def backoff_seconds(attempt: int) -> float:
+    return min(config['engine-retry-backoff-seconds'] * 2 ** attempt, MAX_BACKOFF_SECONDS)
+
+def get_quarantined_keys(db: Database) -> set[int]:
+    global quarantined_keys, quarantine_loaded_at
+    with quarantine_lock:
+        if quarantined_keys is None or time.monotonic() - quarantine_loaded_at >= QUARANTINE_REFRESH_SECONDS:
+            quarantined_keys = {document['_id'] for document in db.quarantined_positions.find({}, {'_id': 1})}
+            quarantine_loaded_at = time.monotonic()
+        return quarantined_keys
+
+def release_positions(db: Database, keys: Optional[list[int]] = None) -> int:
+    _filter = {} if keys is None else {'_id': {'$in': keys}}
+    released = db.quarantined_positions.delete_many(_filter).deleted_count
+    with quarantine_lock:
+        if quarantined_keys is not None and keys is None:
+            quarantined_keys.clear()
+        elif quarantined_keys is not None:
+            quarantined_keys.difference_update(keys)
+    return released
+
+def check_quarantine(db: Database, board: Board) -> None:
+    if db is not None and position_key(board) in get_quarantined_keys(db):
+        raise PositionQuarantined(f'Position is quarantined: {board.fen()}')
+
+def retry_attempts() -> int:
+    # every position gets at least one try, whatever the config says
+    return max(1, config['engine-retry-attempts'])
+
+def quarantine_position(db: Database, board: Board, hexdigest: str, error: Exception) -> None:
+    key = position_key(board)
+    increment('positions-quarantined')
+    if db is not None:
+        get_quarantined_keys(db).add(key)
+        db.quarantined_positions.update_one({'_id': key}, {
+            '$set': {'fen': board.fen(), 'error': str(error)},
+            '$inc': {'failures': retry_attempts()},
+            '$addToSet': {'games': hexdigest}
+        }, upsert=True)
+    raise PositionQuarantined(f'Quarantined {board.fen()} after {retry_attempts()} engine failures: {error}')
+
+def report_failure(error: Exception, attempt: int) -> None:
+    increment('engine-crashes')
+    print(f'Engine failed (attempt {attempt + 1}/{retry_attempts()}): {error}', file=sys.stderr)
+
+class EngineSupervisor:
+    def __init__(self, pool: EnginePool):
+        self.pool = pool
+        self.slot = None
+
+    def __enter__(self) -> 'EngineSupervisor':
+        self.slot = self.pool.checkout()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self.slot is not None:
+            self.pool.checkin(*self.slot)
+            self.slot = None
+
+    def discard(self) -> None:
+        self.pool.checkin(*self.slot, failed=True)
+        self.slot = None
+
+    def restart(self, attempt: int) -> None:
+        self.discard()
+        time.sleep(backoff_seconds(attempt))
+        self.slot = self.pool.checkout()
+        increment('engine-restarts')
+
+    def run(self, db: Database, board: Board, hexdigest: str, task: Callable[[SimpleEngine], T]) -> T:
+        check_quarantine(db, board)
+        if self.slot is None:
+            self.slot = self.pool.checkout()
+        for attempt in range(retry_attempts()):
+            try:
+                return task(self.slot[0])
+            except ENGINE_FAILURES as e:
+                error = e
+                report_failure(e, attempt)
+                # no point waiting for a fresh engine only to quarantine the position
+                if attempt < retry_attempts() - 1:
+                    self.restart(attempt)
+                else:
+                    self.discard()
+        quarantine_position(db, board, hexdigest, error)
+
+class AsyncEngineSupervisor:
+    def __init__(self):
+        self.protocol = None
+
+    async def start(self) -> None:
+        self.protocol = await make_async_engine()
+
+    def close(self) -> None:
+        if self.protocol is not None:
+            self.protocol.transport.close()
+            self.protocol = None
+
+    async def restart(self, attempt: int) -> None:
+        self.close()
+        await asyncio.sleep(backoff_seconds(attempt))
+        await self.start()
+        increment('engine-restarts')
+
+    async def run(self, db: Database, board: Board, hexdigest: str,
+                  task: Callable[[UciProtocol], Awaitable[T]]) -> T:
+        await asyncio.to_thread(check_quarantine, db, board)
+        if self.protocol is None:
+            await self.start()
+        for attempt in range(retry_attempts()):
+            try:
+                return await task(self.protocol)
+            except ENGINE_FAILURES as e:
+                error = e
+                report_failure(e, attempt)
+                if attempt < retry_attempts() - 1:
+                    await self.restart(attempt)
+                else:
+                    self.close()
+        await asyncio.to_thread(quarantine_position, db, board, hexdigest, error)
+
+def format_supervisor_stats(counters: Counter) -> Optional[str]:
+    crashes = counters['engine-crashes']
+    if not crashes:
+        return None
+    return (f'Engine supervisor: {crashes} crashes, {counters["engine-restarts"]} restarts, '
+            f'{counters["positions-quarantined"]} positions quarantined')
+
+register_reporter(format_supervisor_stats)
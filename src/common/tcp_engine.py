@@ -0,0 +1,75 @@
+import asyncio
+from typing import Optional
+
+from chess.engine import SimpleEngine, UciProtocol, run_in_background
+
+DEFAULT_ENGINE_SERVER_PORT = 9999
+
+def parse_address(address: str) -> tuple[str, int]:
+    host, _, port = address.removeprefix('tcp://').partition(':')
+    return host, int(port) if port else DEFAULT_ENGINE_SERVER_PORT
+
+class TcpEngineTransport(asyncio.SubprocessTransport):
+    # lets UciProtocol, which expects a subprocess, talk to an engine-server socket
+    def __init__(self, protocol: UciProtocol):
+        super().__init__()
+        self.protocol = protocol
+        self.socket_transport = None
+        self.returncode = None
+
+    def get_pipe_transport(self, fd: int) -> Optional[asyncio.BaseTransport]:
+        return self.socket_transport
+
+    def get_pid(self) -> int:
+        return id(self)
+
+    def get_returncode(self) -> Optional[int]:
+        return self.returncode
+
+    def close(self) -> None:
+        if self.socket_transport is not None:
+            self.socket_transport.close()
+
+    def kill(self) -> None:
+        self.close()
+
+    def terminate(self) -> None:
+        self.close()
+
+class TcpEngineStream(asyncio.Protocol):
+    def __init__(self, transport: TcpEngineTransport, protocol: UciProtocol):
+        self.transport = transport
+        self.protocol = protocol
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport.socket_transport = transport
+        self.protocol.connection_made(self.transport)
+
+    def data_received(self, data: bytes) -> None:
+        self.protocol.pipe_data_received(1, data)
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.transport.returncode = 0 if exc is None else 1
+        self.protocol.connection_lost(exc)
+
+async def connect_uci(address: str) -> tuple[TcpEngineTransport, UciProtocol]:
+    host, port = parse_address(address)
+    protocol = UciProtocol()
+    transport = TcpEngineTransport(protocol)
+    await asyncio.get_running_loop().create_connection(
+        lambda: TcpEngineStream(transport, protocol), host, port)
+    await protocol.initialize()
+    return transport, protocol
+
+def connect_tcp_engine(address: str, timeout: float = 10.0) -> SimpleEngine:
+    async def background(future):
+        transport, protocol = await asyncio.wait_for(connect_uci(address), timeout)
+        simple_engine = SimpleEngine(transport, protocol, timeout=timeout)
+        try:
+            future.set_result(simple_engine)
+            returncode = await protocol.returncode
+            simple_engine.returncode.set_result(returncode)
+        finally:
+            simple_engine.close()
+        await simple_engine.shutdown_event.wait()
+    return run_in_background(background, name=f'SimpleEngine (address={address!r})')
@@ -7,7 +7,9 @@ import os
 from importlib import import_module
 from argparse import Namespace
 import re
-from typing import Generator
+from itertools import islice
+from random import Random
+from typing import Generator, Optional
 from types import ModuleType
 
 from chess import (
@@ -24,17 +26,32 @@ from chess import (
     Move
 )
 from chess.pgn import read_game, Game
-from chess.engine import INFO_SCORE, EngineTerminatedError, SimpleEngine
+from chess.engine import INFO_SCORE, INFO_PV, SimpleEngine, PovScore
 from chess.pgn import StringExporter
+import bson
 from pymongo.database import Database
+from pymongo.errors import ExecutionTimeout
 
-from .engine import make_engine, limit
-from .remote_engine import set_remote_available
-from .db import make_db, fetch_move_accuracy_from_db, collation
+from .engine import limit
+from .engine_pool import get_engine_pool
+from .eval_cache import eval_cache, search_key
+from .bypass import evaluate_without_engine
+from .budget import get_budget_policy
+from .stats import increment
+from .supervisor import EngineSupervisor, PositionQuarantined
+from .checkpoint import GameCheckpoint
+from .db import make_db, fetch_move_accuracy_from_db, fetch_move_accuracy_progress, collation, is_complete
 from .filters import merge_filters
+from .features import fill_missing_features
+from .config import config
 
 PIECES = [PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING]
 PIECES_STR = ['pawn', 'knight', 'bishop', 'rook', 'queen', 'king']
+MIN_BATCH_SIZE = 10
+MAX_BATCH_SIZE = 5000
+TARGET_BATCH_BYTES = 4 * 1024 * 1024
+ESTIMATED_COUNT_MS = 200
+COUNT_MODES = ['exact', 'estimated', 'none']
 
 MODULES = list(
     map(lambda f: f[:-3],
@@ -101,31 +118,78 @@ def map_pieces_option(args: Namespace) -> Namespace:
 def load_module(module: str) -> ModuleType:
     return import_module(f'modules.{module}', 'src')
 
-def evaluate_move(board: Board, engine: SimpleEngine, move: Move) -> float:
-    info = engine.analyse(board, limit(), root_moves=[move], multipv=1, info=INFO_SCORE)
-    relative_eval = info[0]['score'].relative
+def score_value(score: PovScore) -> float:
+    relative_eval = score.relative
     if relative_eval.is_mate():
-        value = 10000 - info[0]['score'].relative.mate()
-        if info[0]['score'].relative.mate() < 0:
+        value = 10000 - relative_eval.mate()
+        if relative_eval.mate() < 0:
             value = -value
     else:
         value = relative_eval.cp
     return value
 
+def evaluate_move(board: Board, engine: SimpleEngine, move: Move, factor: float = 1) -> float:
+    info = engine.analyse(board, limit(factor), root_moves=[move], multipv=1, info=INFO_SCORE)
+    return score_value(info[0]['score'])
+
+def evaluate_moves_per_move(board: Board, engine: SimpleEngine, moves: list[Move],
+                            factor: float = 1) -> dict[Move, float]:
+    return {move: evaluate_move(board, engine, move, factor) for move in moves}
+
+def evaluate_moves_multipv(board: Board, engine: SimpleEngine, legal_moves: list[Move],
+                           factor: float = 1) -> dict[Move, float]:
+    lines = config['multipv-lines']
+    move_values = {}
+    for chunk_start in range(0, len(legal_moves), lines):
+        chunk = legal_moves[chunk_start:chunk_start + lines]
+        infos = engine.analyse(board, limit(factor), root_moves=chunk, multipv=len(chunk),
+                               info=INFO_SCORE | INFO_PV)
+        for info in infos:
+            if info.get('pv') and 'score' in info:
+                move_values[info['pv'][0]] = score_value(info['score'])
+        # engines may report fewer lines than requested, score the rest one by one
+        for legal_move in chunk:
+            if legal_move not in move_values:
+                move_values[legal_move] = evaluate_move(board, engine, legal_move, factor)
+    return move_values
+
+RANKING_MODES = {
+    'per-move': evaluate_moves_per_move,
+    'multipv': evaluate_moves_multipv
+}
+
+def expected_engine_calls(ranking_mode: str, move_count: int) -> int:
+    if ranking_mode == 'multipv':
+        return -(-move_count // config['multipv-lines'])
+    return move_count
+
 def hash_pgn(pgn: str) -> str:
     return hashlib.md5(pgn.encode('utf-8')).hexdigest()
 
 def get_game_result(game: Game, username: str) -> float:
-    color = WHITE if game.headers['White'] == username else BLACK
+    return get_game_result_from_headers(game.headers, username)
+
+def get_game_result_from_headers(headers: dict, username: str) -> float:
+    color = WHITE if headers['White'].lower() == username.lower() else BLACK
     result = 0.5
-    if game.headers['Result'] == '1-0':
+    if headers['Result'] == '1-0':
         result = 1 if color == WHITE else -1
-    elif game.headers['Result'] == '0-1':
+    elif headers['Result'] == '0-1':
         result = 1 if color == BLACK else -1
     else:
         result = 0.5
     return result
 
+def game_result_expression(username: str) -> dict:
+    # the same scoring as get_game_result_from_headers, evaluated by the server
+    is_white = {'$eq': [{'$toLower': '$headers.White'}, username.lower()]}
+    win = {'$cond': [is_white, '1-0', '0-1']}
+    loss = {'$cond': [is_white, '0-1', '1-0']}
+    return {'$cond': [
+        {'$eq': ['$headers.Result', win]}, 1,
+        {'$cond': [{'$eq': ['$headers.Result', loss]}, -1, 0.5]}
+    ]}
+
 def string_as_color(string: str) -> bool:
     if string.lower() == 'white':
         return WHITE
@@ -140,68 +204,188 @@ def color_as_string(color: bool) -> str:
         return 'black'
     raise ValueError()
 
-def count_user_games(db: Database, args: Namespace) -> int:
+def count_user_games(db: Database, args: Namespace, mode: str = None) -> Optional[int]:
+    mode = mode or getattr(args, 'count_mode', 'exact')
+    if mode == 'none':
+        return None
     _filter = merge_filters(args)
-    document_count = db.games.count_documents(_filter, collation=collation())
-    return document_count
+    if mode == 'estimated':
+        try:
+            document_count = db.games.count_documents(_filter, collation=collation(), maxTimeMS=ESTIMATED_COUNT_MS)
+        except ExecutionTimeout:
+            # the whole collection is an upper bound, good enough for a progress bar
+            document_count = db.games.estimated_document_count()
+    else:
+        document_count = db.games.count_documents(_filter, collation=collation())
+    return document_count if args.limit is None else min(document_count, args.limit)
+
+def make_projection(fields: Optional[list[str]]) -> Optional[dict]:
+    if fields is None:
+        return None
+    return {field: 1 for field in fields + ['hexdigest']}
+
+def adaptive_batch_size(db: Database, _filter: dict, projection: Optional[dict]) -> int:
+    sample = db.games.find_one(_filter, projection, collation=collation())
+    if sample is None:
+        return MIN_BATCH_SIZE
+    return max(MIN_BATCH_SIZE, min(MAX_BATCH_SIZE, TARGET_BATCH_BYTES // len(bson.encode(sample))))
+
+def attach_move_accuracy(db: Database, game_documents: list[dict], username: str) -> None:
+    move_accuracies = db.move_accuracy.find({
+            'hexdigest': {'$in': [game_document['hexdigest'] for game_document in game_documents]},
+            'username': username
+        }, {'_id': 0, 'hexdigest': 1, 'move_accuracy': 1, 'complete': 1})
+    by_hexdigest = {document['hexdigest']: document['move_accuracy']
+                    for document in move_accuracies if is_complete(document)}
+    for game_document in game_documents:
+        game_document['move_accuracy'] = by_hexdigest.get(game_document['hexdigest'])
 
-def make_game_generator(db: Database, args: Namespace) -> Generator[dict, None, None]:
+def make_game_generator(db: Database, args: Namespace, fields: list[str] = None,
+                        with_move_accuracy: bool = False,
+                        with_features: bool = False) -> Generator[dict, None, None]:
     _filter = merge_filters(args)
     _filter.update({'invalid': { '$exists': False }})
-    cursor = db.games.find(_filter, collation=collation()).batch_size(10)
+    projection = make_projection(fields)
+    # size batches by what the projection returns, header-only reads fit far more per round trip
+    batch_size = adaptive_batch_size(db, _filter, projection)
+    cursor = db.games.find(_filter, projection, collation=collation()).batch_size(batch_size)
     if args.limit is not None:
         cursor = cursor.limit(args.limit)
+    try:
+        if not with_move_accuracy and not with_features:
+            yield from cursor
+            return
+        # one $in query per batch instead of one lookup per game
+        while chunk := list(islice(cursor, batch_size)):
+            if with_move_accuracy:
+                attach_move_accuracy(db, chunk, args.username)
+            if with_features:
+                fill_missing_features(db, chunk)
+            yield from chunk
+    finally:
+        cursor.close()
+
+def aggregate_user_games(db: Database, args: Namespace, stages: list[dict]) -> list[dict]:
+    _filter = merge_filters(args)
+    _filter.update({'invalid': { '$exists': False }})
+    pipeline = [{'$match': _filter}]
+    if args.limit is not None:
+        pipeline.append({'$limit': args.limit})
+    return list(db.games.aggregate(pipeline + stages, collation=collation()))
+
+def make_random_game_generator(db: Database, args: Namespace, size: int,
+                               fields: list[str] = None) -> Generator[dict, None, None]:
+    _filter = merge_filters(args)
+    _filter.update({'invalid': { '$exists': False }})
+    pipeline = [
+        {'$match': _filter},
+        {'$sample': {'size': size}}
+    ]
+    if fields is not None:
+        pipeline.append({'$project': make_projection(fields)})
+    cursor = db.games.aggregate(pipeline, collation=collation(), allowDiskUse=True, batchSize=10)
     try:
         for game_document in cursor:
             yield game_document
     finally:
         cursor.close()
 
-def get_move_accuracy_for_game(pgn: str, username: str) -> list[float]:
+def get_move_accuracy_for_game(pgn: str, username: str, ranking_mode: str = None) -> list[float]:
+    game = read_game(StringIO(pgn))
+    color = get_user_color(username, game)
+    try:
+        return get_move_accuracy_for_players(pgn, game, {color: username}, ranking_mode)[color]
+    except PositionQuarantined as e:
+        # the game stays incomplete and resumes once the position is released with the quarantine command
+        print(e, file=sys.stderr)
+        return []
+
+def get_move_accuracy_for_both_sides(pgn: str, ranking_mode: str = None) -> dict[bool, list[float]]:
+    game = read_game(StringIO(pgn))
+    players = {WHITE: game.headers['White'], BLACK: game.headers['Black']}
+    try:
+        return get_move_accuracy_for_players(pgn, game, players, ranking_mode)
+    except PositionQuarantined as e:
+        print(e, file=sys.stderr)
+        return {color: [] for color in players}
+
+def get_move_accuracy_for_players(pgn: str, game: Game, players: dict[bool, str],
+                                  ranking_mode: str = None) -> dict[bool, list[float]]:
+    ranking_mode = ranking_mode or config['ranking-mode']
     db = make_db()
     hexdigest = hash_pgn(pgn)
-    move_accuracy_from_db = fetch_move_accuracy_from_db(db, hexdigest, username)
-    if move_accuracy_from_db:
-        return move_accuracy_from_db
-    engine, remote = make_engine()
-    move_accuracy = []
-    game = read_game(StringIO(pgn))
+    move_accuracy = {}
+    progress = {}
+    for color, username in players.items():
+        scored, complete = fetch_move_accuracy_progress(db, hexdigest, username)
+        if complete:
+            move_accuracy[color] = scored
+        else:
+            progress[color] = scored
+    if not progress:
+        return move_accuracy
+    checkpoint = GameCheckpoint(hexdigest, players, progress)
+    color_plies = {color: 0 for color in progress}
     board = game.board()
-    color = get_user_color(username, game)
-    for actual_move in game.mainline_moves():
-        if board.turn != color:
-            board.push(actual_move)
-            continue
-        try:
-            raw_move_accuracy = get_move_accuracy(db, board, engine, actual_move, pgn)
-            move_accuracy.append(raw_move_accuracy)
-            board.push(actual_move)
-        except EngineTerminatedError as e:
-            db.games.update_one({'hexdigest': hexdigest}, {"$set": { 'invalid': True }})
-            if 'engine process died' not in str(e):
-                print(e)
-                sys.exit(1)
-            elif remote:
-                set_remote_available(remote, True)
-            return []
-    db.move_accuracy.insert_one({
-        'hexdigest': hexdigest,
-        'username': username,
-        'move_accuracy': move_accuracy
-    })
+    try:
+        with EngineSupervisor(get_engine_pool()) as supervisor:
+            for actual_move in game.mainline_moves():
+                color = board.turn
+                # plies scored by an interrupted run are skipped
+                if color in progress and color_plies[color] >= checkpoint.scored_count(color):
+                    raw_move_accuracy, budget = supervisor.run(db, board, hexdigest, lambda engine: score_move(
+                        db, board, engine, actual_move, ranking_mode))
+                    checkpoint.record(color, raw_move_accuracy, budget)
+                    if checkpoint.due():
+                        db.move_accuracy.bulk_write(checkpoint.drain(complete=False))
+                if color in progress:
+                    color_plies[color] += 1
+                board.push(actual_move)
+    except BaseException:
+        write_partial_checkpoint(db, checkpoint)
+        raise
+    db.move_accuracy.bulk_write(checkpoint.drain(complete=True))
     result = db.games.update_one({'hexdigest': hexdigest}, {'$addToSet': { 'tags': 'accuracy'}})
-    if result.modified_count != 1 and len(move_accuracy) > 0:
+    if result.matched_count != 1:
         raise AttributeError(f'Game {hexdigest} was not updated')
-    db.client.close()
-    engine.close()
-    if remote:
-        set_remote_available(remote, True)
+    move_accuracy.update(checkpoint.move_accuracy())
     return move_accuracy
 
-def get_move_accuracy(db: Database, board: Board, engine: SimpleEngine, move: Move, pgn: str) -> float:
+def get_sampled_move_accuracy(pgn: str, username: str, ply_count: int, rng: Random,
+                              ranking_mode: str = None) -> list[float]:
+    ranking_mode = ranking_mode or config['ranking-mode']
+    db = make_db()
+    hexdigest = hash_pgn(pgn)
+    move_accuracy = fetch_move_accuracy_from_db(db, hexdigest, username)
+    if move_accuracy:
+        return move_accuracy
+    game = read_game(StringIO(pgn))
+    color = get_user_color(username, game)
+    positions = []
+    board = game.board()
+    for actual_move in game.mainline_moves():
+        if board.turn == color:
+            positions.append((board.copy(stack=False), actual_move))
+        board.push(actual_move)
+    sampled_positions = rng.sample(positions, min(ply_count, len(positions)))
+    # sampled plies are not checkpointed, only their evaluations are cached
+    try:
+        with EngineSupervisor(get_engine_pool()) as supervisor:
+            return [supervisor.run(db, board, hexdigest, lambda engine: score_move(
+                        db, board, engine, actual_move, ranking_mode)[0])
+                    for board, actual_move in sampled_positions]
+    except PositionQuarantined as e:
+        print(e, file=sys.stderr)
+        return []
+
+def write_partial_checkpoint(db: Database, checkpoint: GameCheckpoint) -> None:
+    requests = checkpoint.drain(complete=False)
+    if requests:
+        db.move_accuracy.bulk_write(requests)
+
+def rank_move_accuracy(move_values: dict[Move, float], move: Move) -> float:
     moves = {}
-    for legal_move in board.legal_moves:
-        value = evaluate_move(board, engine, legal_move)
+    for legal_move, value in move_values.items():
         if value not in moves:
             moves[value] = []
         moves[value].append(legal_move)
@@ -215,6 +399,38 @@ def get_move_accuracy(db: Database, board: Board, engine: SimpleEngine, move: Mo
     raw_move_accuracy = (legal_move_count - actual_move_rank)/legal_move_count
     return raw_move_accuracy
 
+def evaluate_position(db: Database, board: Board, engine: SimpleEngine,
+                      ranking_mode: str = 'per-move', factor: float = 1) -> dict[Move, float]:
+    legal_moves = list(board.legal_moves)
+    move_values = evaluate_without_engine(board, legal_moves)
+    if move_values is not None:
+        increment('engine-calls-avoided', expected_engine_calls(ranking_mode, len(legal_moves)))
+        return move_values
+    search = search_key(ranking_mode, factor)
+    move_values = eval_cache.get_many(db, board, legal_moves, search)
+    missing_moves = [move for move in legal_moves if move not in move_values]
+    if missing_moves:
+        searched_values = RANKING_MODES[ranking_mode](board, engine, missing_moves, factor)
+        eval_cache.put_many(db, board, searched_values, search)
+        move_values.update(searched_values)
+    return move_values
+
+def score_move(db: Database, board: Board, engine: SimpleEngine, move: Move,
+               ranking_mode: str = 'per-move') -> tuple[float, float]:
+    policy = get_budget_policy()
+    factor = policy.initial_factor(board)
+    while True:
+        move_values = evaluate_position(db, board, engine, ranking_mode, factor)
+        next_factor = policy.next_factor(board, move_values, move, factor)
+        if next_factor is None:
+            return rank_move_accuracy(move_values, move), factor
+        increment('budget-escalations')
+        factor = next_factor
+
+def get_move_accuracy(db: Database, board: Board, engine: SimpleEngine, move: Move, pgn: str,
+                      ranking_mode: str = 'per-move') -> float:
+    return score_move(db, board, engine, move, ranking_mode)[0]
+
 def get_game_datetime(pgn: str) -> datetime:
     game = read_game(StringIO(pgn))
     game_date = game.headers['UTCDate']
@@ -0,0 +1,90 @@
+import sys
+from argparse import Namespace
+from collections import Counter
+from io import StringIO
+
+from chess import Board
+from chess.pgn import read_game
+from pymongo.database import Database
+from tqdm import tqdm
+
+from .bypass import can_bypass_engine
+from .budget import get_budget_policy
+from .engine import is_deterministic_limit
+from .engine_pool import get_engine_pool
+from .eval_cache import position_key
+from .config import config
+from .scheduler import run_bounded
+from .util import (
+    make_game_generator,
+    count_user_games,
+    get_user_color,
+    evaluate_position,
+    expected_engine_calls
+)
+
+def count_positions(db: Database, args: Namespace, both_sides: bool) -> tuple[Counter, dict[int, str], dict[int, int]]:
+    occurrences = Counter()
+    fens = {}
+    move_counts = {}
+    game_count = count_user_games(db, args)
+    for game_document in tqdm(make_game_generator(db, args, ['pgn']), total=game_count, desc='Planning'):
+        game = read_game(StringIO(game_document['pgn']))
+        board = game.board()
+        color = None if both_sides else get_user_color(args.username, game)
+        for move in game.mainline_moves():
+            if color is None or board.turn == color:
+                key = position_key(board)
+                if key not in fens:
+                    move_count = board.legal_moves.count()
+                    fens[key] = None if can_bypass_engine(board, move_count) else board.fen()
+                    move_counts[key] = move_count
+                if fens[key] is not None:
+                    occurrences[key] += 1
+            board.push(move)
+    return occurrences, fens, move_counts
+
+def report_plan(occurrences: Counter, move_counts: dict[int, int], hot_positions: list[int], ranking_mode: str) -> None:
+    total = sum(occurrences.values())
+    unique = len(occurrences)
+    if not unique:
+        print('Planning: no positions need the engine', file=sys.stderr)
+        return
+    calls_per_ply = sum(count * expected_engine_calls(ranking_mode, move_counts[key])
+                        for key, count in occurrences.items())
+    calls_per_position = sum(expected_engine_calls(ranking_mode, move_counts[key]) for key in occurrences)
+    hot_plies = sum(occurrences[key] for key in hot_positions)
+    print(f'Planning: {total} plies, {unique} unique positions '
+          f'({total/unique:.2f}x deduplication)', file=sys.stderr)
+    print(f'Planning: {len(hot_positions)} hot positions cover {hot_plies} plies', file=sys.stderr)
+    print(f'Planning: {calls_per_ply} engine calls without deduplication, '
+          f'{calls_per_position} with ({calls_per_ply - calls_per_position} saved)', file=sys.stderr)
+
+def select_hot_positions(occurrences: Counter, move_counts: dict[int, int], min_count: int) -> list[int]:
+    hot_positions = []
+    # without a persistent cache level only what fits the in-process LRU can be warmed
+    budget = sys.maxsize if is_deterministic_limit() else config['eval-cache-size']
+    for key, count in occurrences.most_common():
+        if count < min_count or budget < move_counts[key]:
+            break
+        budget -= move_counts[key]
+        hot_positions.append(key)
+    return hot_positions
+
+def warm_positions(db: Database, fens: list[str], ranking_mode: str, worker_count: int) -> None:
+    pool = get_engine_pool(worker_count)
+    def warm_position(fen):
+        board = Board(fen)
+        with pool.lease() as engine:
+            # warm the budget every game analysis starts from
+            evaluate_position(db, board, engine, ranking_mode, get_budget_policy().initial_factor(board))
+    with tqdm(total=len(fens), desc='Warming') as pbar:
+        run_bounded(fens, warm_position, lambda fen, _: pbar.update(1), worker_count)
+
+def plan_and_warm(db: Database, args: Namespace, both_sides: bool = False) -> None:
+    occurrences, fens, move_counts = count_positions(db, args, both_sides)
+    hot_positions = select_hot_positions(occurrences, move_counts, args.warm_min_count)
+    report_plan(occurrences, move_counts, hot_positions, args.ranking_mode)
+    if args.plan_only or not hot_positions:
+        return
+    warm_positions(db, [fens[key] for key in hot_positions], args.ranking_mode, args.worker_count)
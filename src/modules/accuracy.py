@@ -1,70 +1,125 @@
-from functools import partial
 import sys
-import time
-from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
+from itertools import takewhile
+from random import Random
 
 from tqdm import tqdm
 from chess.pgn import read_game
 
+from common.autotune import apply_auto_tune
+from common.engine import configure_search_limit
+from common.engine_pool import get_engine_pool
+from common.stats import report_stats
+from common.scheduler import run_bounded
+from common.warmup import plan_and_warm
+from common.sampling import RunningEstimate, StoppingRule
+from common.async_pipeline import analyse_games_async, check_pipeline_options
 from common.db import make_db
 from common.util import (
     make_game_generator,
+    make_random_game_generator,
     get_move_accuracy_for_game,
+    get_sampled_move_accuracy,
     count_user_games
 )
 from common.options import (
     username_option,
     color_option,
     limit_option,
+    count_mode_option,
     worker_count_option,
-    remote_engines_option
+    remote_engines_option,
+    ranking_mode_option,
+    search_limit_options,
+    warm_cache_options,
+    pipeline_option,
+    approximate_options
 )
 
+def analyse_threaded(db, args, game_accuracies):
+    game_count = count_user_games(db, args)
+    with tqdm(total=game_count, smoothing=False) as pbar:
+        def analyse(game_document):
+            return get_move_accuracy_for_game(game_document['pgn'], args.username, args.ranking_mode)
+        def collect(game_document, move_accuracy):
+            if len(move_accuracy) != 0:
+                game_accuracy = sum(move_accuracy) / len(move_accuracy)
+                game_accuracies.append(game_accuracy)
+            pbar.set_description(f'Analyzed {game_document["hexdigest"]}')
+            pbar.update(1)
+        run_bounded(make_game_generator(db, args, ['pgn']), analyse, collect, args.worker_count)
+
+def analyse_asyncio(args, game_accuracies):
+    def collect(hexdigest, move_accuracy):
+        for color_move_accuracy in move_accuracy.values():
+            if len(color_move_accuracy) != 0:
+                game_accuracies.append(sum(color_move_accuracy) / len(color_move_accuracy))
+    analyse_games_async(args, collect)
+
+def analyse_approximately(db, args):
+    population = count_user_games(db, args, mode='exact')
+    estimate = RunningEstimate(population, args.confidence)
+    stopping_rule = StoppingRule(estimate, args.error_bound, args.time_budget)
+    with tqdm(total=population, smoothing=False) as pbar:
+        def analyse(game_document):
+            if args.sample_plies:
+                # one generator per game, a shared one would be drawn from in thread order
+                rng = Random(None if args.seed is None else f'{args.seed}:{game_document["hexdigest"]}')
+                return get_sampled_move_accuracy(game_document['pgn'], args.username, args.sample_plies,
+                                                 rng, args.ranking_mode)
+            return get_move_accuracy_for_game(game_document['pgn'], args.username, args.ranking_mode)
+        def collect(game_document, move_accuracy):
+            if len(move_accuracy) != 0:
+                estimate.add(sum(move_accuracy) / len(move_accuracy))
+            pbar.set_description(f'Accuracy {estimate.mean*100:.2f}% +-{estimate.half_width()*100:.2f}%')
+            pbar.update(1)
+        games = takewhile(lambda _: not stopping_rule.reached(), make_random_game_generator(db, args, population, ['pgn']))
+        run_bounded(games, analyse, collect, args.worker_count)
+    return estimate
+
+def run_approximate(db, args):
+    get_engine_pool(args.worker_count)
+    estimate = analyse_approximately(db, args)
+    report_stats()
+    if not estimate.count:
+        print(f'No games found in the database for {args.username}', file=sys.stderr)
+        return None
+    print(f'Games analyzed: {estimate.count} of {estimate.population}')
+    print(f'Average accuracy: {estimate.mean*100:.2f}% '
+          f'+-{estimate.half_width()*100:.2f}% ({args.confidence*100:g}% confidence)')
+    return estimate.mean
+
 def run(args):
     username = args.username
     if not username:
         print('Username is required', file=sys.stderr)
+    if not check_pipeline_options(args):
+        return None
     db = make_db()
     game_accuracies = []
-    game_count = count_user_games(db, args)
-    game_generator = make_game_generator(db, args)
-    with ThreadPoolExecutor(max_workers=args.worker_count) as executor:
-        with tqdm(total=game_count, smoothing=False) as pbar:
-            active_threads = set()
-            def pop_future1(game_accuracies, future):
-                move_accuracy = future.result()
-                if len(move_accuracy) != 0:
-                    game_accuracy = sum(move_accuracy) / len(move_accuracy)
-                    game_accuracies += [game_accuracy]
-                active_threads.remove(future)
-                pbar.update(1)
-            pop_future2 = partial(pop_future1, game_accuracies)
-            while True:
-                try:
-                    while len(active_threads) == args.worker_count:
-                        time.sleep(0.1)
-                    game_document = next(game_generator)
-                    hexdigest = game_document['hexdigest']
-                    pbar.set_description(f'Analyzing {hexdigest}')
-                    future = executor.submit(get_move_accuracy_for_game,
-                                             game_document['pgn'],
-                                             username)
-                    active_threads.add(future)
-                    future.add_done_callback(pop_future2)
-                except StopIteration:
-                    break
-        db.client.close()
-        while len(active_threads) > 0:
-            time.sleep(0.1)
-        if not game_accuracies:
-            print(f'No games found in the database for {username}', file=sys.stderr)
+    configure_search_limit(args)
+    apply_auto_tune(args)
+    if args.warm_cache or args.plan_only:
+        get_engine_pool(args.worker_count)
+        plan_and_warm(db, args)
+        if args.plan_only:
             return None
-        games_analyzed = len(game_accuracies)
-        average_accuracy = sum(game_accuracies) / games_analyzed
-        print(f'Games analyzed: {games_analyzed}')
-        print(f'Average accuracy: {average_accuracy*100:.2f}%')
-        return average_accuracy
+    if args.approximate:
+        return run_approximate(db, args)
+    if args.pipeline == 'asyncio':
+        analyse_asyncio(args, game_accuracies)
+    else:
+        get_engine_pool(args.worker_count)
+        analyse_threaded(db, args, game_accuracies)
+    report_stats()
+    if not game_accuracies:
+        print(f'No games found in the database for {username}', file=sys.stderr)
+        return None
+    games_analyzed = len(game_accuracies)
+    average_accuracy = sum(game_accuracies) / games_analyzed
+    print(f'Games analyzed: {games_analyzed}')
+    print(f'Average accuracy: {average_accuracy*100:.2f}%')
+    return average_accuracy
 
 
 def add_subparser(action_name, subparsers):
@@ -73,5 +128,11 @@ def add_subparser(action_name, subparsers):
     username_option(average_accuracy_parser)
     color_option(average_accuracy_parser)
     limit_option(average_accuracy_parser)
+    count_mode_option(average_accuracy_parser)
     worker_count_option(average_accuracy_parser)
-    remote_engines_option(average_accuracy_parser)
\ No newline at end of file
+    remote_engines_option(average_accuracy_parser)
+    ranking_mode_option(average_accuracy_parser)
+    search_limit_options(average_accuracy_parser)
+    warm_cache_options(average_accuracy_parser)
+    pipeline_option(average_accuracy_parser)
+    approximate_options(average_accuracy_parser)
\ No newline at end of file
@@ -1,72 +1,78 @@
-import re
 import sys
-from io import StringIO
 
-from chess import WHITE, BLACK
-from chess.pgn import read_game
-from tqdm import tqdm
-
-from common.util import (
-    make_game_generator, 
-    fetch_move_accuracy_from_db, 
-    hash_pgn, 
-    count_user_games, 
-    get_piece_repr
-)
+from common.features import user_plies, piece_symbols
 from common.db import make_db
+from common.reports import Report, run_report
+from common.rollups import refresh_rollup, rollup_means, rollup_colors
 from common.options import (
     username_option, 
     color_option, 
     limit_option,
+    count_mode_option,
+    rollup_option,
     time_controls_option,
     variant_option,
     date_range_options
 )
 
-def get_piece_accuracy_for_game(db, pgn, username):
+def get_piece_accuracy_for_game(features, headers, username, move_accuracy):
     piece_accuracy = {}
-    move_accuracy = fetch_move_accuracy_from_db(db, hash_pgn(pgn), username)
     if not move_accuracy:
         return {}
-    game = read_game(StringIO(pgn))
-    board = game.board()
-    color = WHITE if game.headers['White'] == username else BLACK
-    for actual_move_idx, actual_move in enumerate(game.mainline_moves()):
-        if board.turn != color:
-            board.push(actual_move)
-            continue
-        piece_repr = get_piece_repr(board, actual_move)
+    symbols = piece_symbols(features)[user_plies(features, headers, username)]
+    for piece_repr, accuracy in zip(symbols, move_accuracy):
         if piece_repr not in piece_accuracy:
             piece_accuracy[piece_repr] = []
-        piece_accuracy[piece_repr] += [move_accuracy[actual_move_idx//2]]
-        board.push(actual_move)
+        piece_accuracy[piece_repr] += [accuracy]
     return piece_accuracy
 
-def run(args):
-    username = args.username
-    if not username:
-        print('Username is required', file=sys.stderr)
-    db = make_db()
-    game_count = count_user_games(db, args)
-    piece_accuracy = {}
-    for game_document in tqdm(make_game_generator(db, args), total=game_count):
-        pgn = game_document['pgn']
-        piece_accuracies_for_game = get_piece_accuracy_for_game(db, pgn, username)
+class AccuracyPerPieceReport(Report):
+    fields = ['headers.White', 'features']
+    with_move_accuracy = True
+
+    def __init__(self, args):
+        super().__init__(args)
+        self.piece_accuracy = {}
+
+    def add(self, game_document, features):
+        if not game_document['move_accuracy']:
+            return
+        piece_accuracies_for_game = get_piece_accuracy_for_game(features(), game_document['headers'], self.username,
+                                                                game_document['move_accuracy'])
         for piece_type, accuracies in piece_accuracies_for_game.items():
-            if piece_type not in piece_accuracy:
-                piece_accuracy[piece_type] = []
-            piece_accuracy[piece_type] += accuracies
-    for piece, accuracies in piece_accuracy.items():
-        piece_accuracy[piece] = sum(accuracies)/len(accuracies)
+            if piece_type not in self.piece_accuracy:
+                self.piece_accuracy[piece_type] = []
+            self.piece_accuracy[piece_type] += accuracies
+
+    def finish(self, db, args):
+        return {piece: sum(accuracies)/len(accuracies) for piece, accuracies in self.piece_accuracy.items()}
+
+def make_report(args):
+    return AccuracyPerPieceReport(args)
+
+def print_report(piece_accuracy):
     for piece, accuracy in piece_accuracy.items():
         print(f'{piece}: {accuracy*100:.2f}%')
 
+def run(args):
+    if not args.username:
+        print('Username is required', file=sys.stderr)
+    db = make_db()
+    if args.rollup:
+        piece_accuracy = rollup_means(refresh_rollup(db, args.username), 'pieces', rollup_colors(args))
+    else:
+        piece_accuracy = run_report(db, args, make_report(args))
+    print_report(piece_accuracy)
+    return piece_accuracy
+
 def add_subparser(action_name, subparsers):
     parser = subparsers.add_parser(
         action_name, help='calculates average accuracy per piece for a user')
     username_option(parser)
     color_option(parser)
     limit_option(parser)
+    count_mode_option(parser)
+    rollup_option(parser)
     time_controls_option(parser)
     date_range_options(parser)
     variant_option(parser)
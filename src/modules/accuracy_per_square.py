@@ -1,66 +1,48 @@
 import sys
-from io import StringIO
 import pickle
 
-from chess import WHITE, BLACK, PieceType, Move
-from chess.pgn import read_game
-from tqdm import tqdm
+from chess import WHITE, BLACK
 import numpy as np
 from bson import Binary
 from pymongo.database import Database
 from argparse import Namespace
 
 from common.util import (
-    make_game_generator,
-    fetch_move_accuracy_from_db,
-    hash_pgn,
-    count_user_games,
     color_as_string,
-    get_user_color_from_pgn,
-    get_piece_type,
-    get_piece_name_from_type,
     get_piece_type_from_name,
     PIECES
 )
 from common.db import make_db
+from common.features import user_plies, destination_coords
+from common.reports import Report, run_report
 from common.options import (
     username_option,
     color_option,
     limit_option,
+    count_mode_option,
     pieces_option,
     date_range_options,
     variant_option,
     time_controls_option
 )
 
-def get_dest_square_coords(move: Move) -> tuple[int, int]:
-    file = move.to_square % 8
-    rank = move.to_square // 8
-    return (file, rank)
-
-def get_square_accuracy_for_game(db: Database, pgn: str, username: str) -> dict[PieceType]:
-    square_accuracy = {
-            piece_type: {
-                'sum': np.zeros((8,8)),
-                'len': np.zeros((8,8))
-            } for piece_type in PIECES
-        }
-    move_accuracy = fetch_move_accuracy_from_db(db, hash_pgn(pgn), username)
-    if not move_accuracy:
-        return {}
-    game = read_game(StringIO(pgn))
-    board = game.board()
-    color = WHITE if game.headers['White'] == username else BLACK
-    for move_idx, move in enumerate(game.mainline_moves()):
-        if board.turn != color:
-            board.push(move)
-            continue
-        dest_square_coords = get_dest_square_coords(move)
-        piece_type = get_piece_type(board, move)
-        square_accuracy[piece_type]['sum'][dest_square_coords] += move_accuracy[move_idx//2]
-        square_accuracy[piece_type]['len'][dest_square_coords] += 1
-        board.push(move)
-    return square_accuracy
+# colour x piece x file x rank, the layout of the stored sums and counts
+STATE_SHAPE = (2, len(PIECES), 8, 8)
+STATE_VERSION = 3
+# digests packed into the summary document itself
+PACKED_STATE_VERSION = 2
+COLOR_INDEX = {WHITE: 0, BLACK: 1}
+DIGEST_SIZE = 16
+FLUSH_GAMES = 1000
+
+def get_square_indices_for_game(features: dict[str, np.ndarray], headers: dict, username: str,
+                                move_accuracy: list[float]) -> tuple[np.ndarray, np.ndarray]:
+    plies = user_plies(features, headers, username)
+    color_index = COLOR_INDEX[headers['White'].lower() == username.lower()]
+    pieces = features['pieces'][plies].astype(np.intp)
+    files, ranks = (coords[plies].astype(np.intp) for coords in destination_coords(features))
+    indices = np.ravel_multi_index((np.full_like(pieces, color_index), pieces - 1, files, ranks), STATE_SHAPE)
+    return indices, np.asarray(move_accuracy, dtype=np.float64)
 
 def plot_results(accuracy_matrix: np.array, username: str, actual_game_count: int, color: bool) -> None:
     plt.figure(figsize=(8, 8))
@@ -87,102 +69,154 @@ def square_coords_to_index(square: str) -> int:
     rank_index = rank - 1
     return file_index + rank_index * 8
 
+def empty_state() -> dict:
+    return {
+        'sums': np.zeros(STATE_SHAPE, dtype=np.float32),
+        'counts': np.zeros(STATE_SHAPE, dtype=np.uint32),
+        'generation': 0,
+        'games': []
+    }
+
+def load_legacy_state(document: dict) -> dict:
+    state = empty_state()
+    for color, color_index in COLOR_INDEX.items():
+        color_string = color_as_string(color)
+        sums, lens = pickle.loads(document[f'sum_{color_string}']), pickle.loads(document[f'len_{color_string}'])
+        for piece_type in PIECES:
+            state['sums'][color_index, piece_type - 1] = sums[piece_type]
+            state['counts'][color_index, piece_type - 1] = lens[piece_type]
+        state['games'].extend(document[f'games_{color_string}'])
+    return state
+
+def load_state(document: dict) -> dict:
+    games = document.get('games', b'')
+    return {
+        'sums': np.frombuffer(document['sums'], dtype=np.float32).reshape(STATE_SHAPE).copy(),
+        'counts': np.frombuffer(document['counts'], dtype=np.uint32).reshape(STATE_SHAPE).copy(),
+        'generation': document.get('generation', 0),
+        'games': [games[idx:idx + DIGEST_SIZE].hex() for idx in range(0, len(games), DIGEST_SIZE)]
+    }
+
 def fetch_accuracy_per_square_for_user(db: Database, args: Namespace) -> dict:
-    _filter = { 'username': args.username }
-    raw_accuracy_per_square = db.accuracy_per_square.find_one(_filter)
-    if not raw_accuracy_per_square:
-        initialization = {
-            'username': args.username,
+    # 'games' are digests that older versions kept in the summary itself,
+    # they move to accuracy_per_square_games when the report starts
+    document = db.accuracy_per_square.find_one({'username': args.username})
+    if not document:
+        state = empty_state()
+    elif document.get('version') in (PACKED_STATE_VERSION, STATE_VERSION):
+        state = load_state(document)
+    else:
+        state = load_legacy_state(document)
+    # digests recorded by a run that never saved its totals are counted again
+    db.accuracy_per_square_games.delete_many({
+        'username': args.username,
+        'generation': {'$gt': state['generation']}
+    })
+    return state
+
+def fetch_processed_games(db: Database, username: str, hexdigests: list[str]) -> set[str]:
+    return {document['hexdigest'] for document in db.accuracy_per_square_games.find({
+        'username': username,
+        'hexdigest': {'$in': hexdigests}
+    }, {'hexdigest': 1})}
 
-            'sum_white': {
-                    piece_type: np.zeros((8,8)) for piece_type in PIECES
-                },
-            'len_white': {
-                    piece_type: np.zeros((8,8)) for piece_type in PIECES
-                },
-            'games_white': [],
-
-            'sum_black': {
-                    piece_type: np.zeros((8,8)) for piece_type in PIECES
-                },
-            'len_black': {
-                    piece_type: np.zeros((8,8)) for piece_type in PIECES
-                },
-            'games_black': []
-        }
-        return initialization
-    accuracy_per_square = raw_accuracy_per_square
-    accuracy_per_square['sum_white'] = pickle.loads(raw_accuracy_per_square['sum_white'])
-    accuracy_per_square['len_white'] = pickle.loads(raw_accuracy_per_square['len_white'])
-    accuracy_per_square['sum_black'] = pickle.loads(raw_accuracy_per_square['sum_black'])
-    accuracy_per_square['len_black'] = pickle.loads(raw_accuracy_per_square['len_black'])
-    return accuracy_per_square
-
-def update_accuracy_per_square_for_user(db: Database, args: Namespace, accuracy_per_square: dict):
-    accuracy_per_square = dict(accuracy_per_square)
-    accuracy_per_square['sum_white'] = Binary(pickle.dumps(accuracy_per_square['sum_white']))
-    accuracy_per_square['sum_black'] = Binary(pickle.dumps(accuracy_per_square['sum_black']))
-    accuracy_per_square['len_white'] = Binary(pickle.dumps(accuracy_per_square['len_white']))
-    accuracy_per_square['len_black'] = Binary(pickle.dumps(accuracy_per_square['len_black']))
+def store_processed_games(db: Database, username: str, hexdigests: list[str], generation: int) -> None:
+    if hexdigests:
+        db.accuracy_per_square_games.insert_many([{
+            'username': username,
+            'hexdigest': hexdigest,
+            'generation': generation
+        } for hexdigest in dict.fromkeys(hexdigests)], ordered=False)
+
+def update_accuracy_per_square_for_user(db: Database, args: Namespace, state: dict):
     db.accuracy_per_square.replace_one({
         'username': args.username,
-        }, accuracy_per_square, upsert=True)
+        }, {
+            'username': args.username,
+            'version': STATE_VERSION,
+            'generation': state['generation'],
+            'sums': Binary(state['sums'].tobytes()),
+            'counts': Binary(state['counts'].tobytes())
+        }, upsert=True)
 
-def add_piece_matrices(sums: np.array, lens: np.array, pieces: str):
-    sum = np.zeros((8,8))
-    len = np.zeros((8,8))
-    for piece_name in pieces:
-        piece_type = get_piece_type_from_name(piece_name)
-        sum += sums[piece_type].copy()
-        len += lens[piece_type].copy()
-    return sum, len
+def make_heatmap(state: dict, colors: list[bool], pieces: list[str]) -> list:
+    color_indices = [COLOR_INDEX[color] for color in colors]
+    piece_indices = [get_piece_type_from_name(piece_name) - 1 for piece_name in pieces]
+    selection = np.ix_(color_indices, piece_indices)
+    sums = state['sums'][selection].sum(axis=(0, 1), dtype=np.float64)
+    counts = state['counts'][selection].sum(axis=(0, 1), dtype=np.float64)
+    heatmap = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+    return np.where(counts == 0, None, heatmap).tolist()
+
+class AccuracyPerSquareReport(Report):
+    fields = ['headers.White', 'features']
+    with_move_accuracy = True
+
+    def __init__(self, args: Namespace):
+        super().__init__(args)
+        self.color = args.color
+        self.db = None
+        self.state = empty_state()
+        self.pending = []
+
+    def start(self, db: Database, args: Namespace):
+        self.db = db
+        self.state = fetch_accuracy_per_square_for_user(db, args)
+        # processed digests of this run are tagged with the generation its totals are saved under
+        self.state['generation'] += 1
+        store_processed_games(db, self.username, self.state.pop('games'), self.state['generation'])
+
+    def add(self, game_document: dict, features):
+        game_color = WHITE if game_document['headers']['White'].lower() == self.username.lower() else BLACK
+        if self.color is not None and self.color != game_color:
+            return
+        if not game_document['move_accuracy']:
+            return
+        self.pending.append((game_document, features))
+        if len(self.pending) >= FLUSH_GAMES:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        processed = fetch_processed_games(self.db, self.username,
+                                          [game_document['hexdigest'] for game_document, _ in self.pending])
+        games = [(game_document, features) for game_document, features in self.pending
+                 if game_document['hexdigest'] not in processed]
+        self.pending = []
+        if not games:
+            return
+        indices, accuracies = zip(*(get_square_indices_for_game(features(), game_document['headers'],
+                                                                 self.username, game_document['move_accuracy'])
+                                    for game_document, features in games))
+        indices = np.concatenate(indices)
+        size = np.prod(STATE_SHAPE)
+        # float64 while summing a batch, the stored totals are float32
+        self.state['sums'] += np.bincount(indices, weights=np.concatenate(accuracies),
+                                          minlength=size).reshape(STATE_SHAPE).astype(np.float32)
+        self.state['counts'] += np.bincount(indices, minlength=size).reshape(STATE_SHAPE).astype(np.uint32)
+        store_processed_games(self.db, self.username, [game_document['hexdigest'] for game_document, _ in games],
+                              self.state['generation'])
+
+    def finish(self, db: Database, args: Namespace) -> list:
+        self.flush()
+        update_accuracy_per_square_for_user(db, args, self.state)
+        colors = [WHITE, BLACK] if args.color is None else [args.color]
+        return make_heatmap(self.state, colors, args.pieces)
+
+def make_report(args: Namespace) -> Report:
+    return AccuracyPerSquareReport(args)
+
+def print_report(heatmap: list):
+    for rank in reversed(range(8)):
+        print(' '.join('   -  ' if heatmap[file][rank] is None else f'{heatmap[file][rank]*100:5.1f}%'
+                       for file in range(8)))
 
 def run(args: Namespace):
     if not args.username:
         print('Username is required', file=sys.stderr)
     db = make_db()
-    game_count = count_user_games(db, args)
-    accuracy_per_square = fetch_accuracy_per_square_for_user(db, args)
-    game_generator = make_game_generator(db, args)
-    processed_games = accuracy_per_square['games_white'] + \
-            accuracy_per_square['games_black']
-    for game_document in tqdm(game_generator, total=game_count):
-        pgn = game_document['pgn']
-        hexdigest = hash_pgn(pgn)
-        if hexdigest in processed_games:
-            continue
-        game_color = get_user_color_from_pgn(args.username, pgn)
-        if args.color and args.color != game_color:
-            continue
-        square_accuracies_per_piece = get_square_accuracy_for_game(db, pgn, args.username)
-        game_color_string = color_as_string(game_color)
-        for piece_type, square_accuracy_matrix in square_accuracies_per_piece.items():
-            accuracy_per_square[f'sum_{game_color_string}'][piece_type] = \
-                accuracy_per_square[f'sum_{game_color_string}'][piece_type].copy() + \
-                square_accuracy_matrix['sum']
-            accuracy_per_square[f'len_{game_color_string}'][piece_type] = \
-                accuracy_per_square[f'len_{game_color_string}'][piece_type].copy() + \
-                square_accuracy_matrix['len']
-            accuracy_per_square[f'games_{game_color_string}'] += [hexdigest]
-    update_accuracy_per_square_for_user(db, args, accuracy_per_square)
-    if args.color is not None:
-        color_string = color_as_string(args.color)
-        sum = np.zeros((8,8))
-        for piece_type, matrix  in accuracy_per_square[f'sum_{color_string}'].items():
-            if get_piece_name_from_type(piece_type) in args.pieces:
-                sum += matrix
-        len = np.zeros((8,8))
-        for piece_type, matrix  in accuracy_per_square[f'len_{color_string}'].items():
-            if get_piece_name_from_type(piece_type) in args.pieces:
-                len += matrix
-    else:
-        sums = list(accuracy_per_square['sum_white'].values()) + \
-            list(accuracy_per_square['sum_black'].values())
-        lens = list(accuracy_per_square['len_white'].values()) + \
-            list(accuracy_per_square['len_black'].values())
-        sum, len = add_piece_matrices(sums, lens, args.pieces)
-    heatmap = np.where(len == 0, None, sum / len).tolist()
-    return heatmap
+    return run_report(db, args, make_report(args))
 
 def add_subparser(action_name: str, subparsers):
     parser = subparsers.add_parser(
@@ -190,6 +224,7 @@ def add_subparser(action_name: str, subparsers):
     username_option(parser)
     color_option(parser)
     limit_option(parser)
+    count_mode_option(parser)
     pieces_option(parser)
     date_range_options(parser)
     variant_option(parser)
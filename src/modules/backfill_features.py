@@ -0,0 +1,30 @@
+from tqdm import tqdm
+
+from common.db import make_db
+from common.features import FEATURES_VERSION, features_update
+from common.options import username_option
+
+BACKFILL_BATCH_SIZE = 500
+
+def run(args):
+    db = make_db()
+    _filter = {'features.version': {'$ne': FEATURES_VERSION}}
+    if args.username:
+        _filter['$or'] = [{'headers.White': args.username}, {'headers.Black': args.username}]
+    game_count = db.games.count_documents(_filter)
+    requests = []
+    updated = 0
+    for game_document in tqdm(db.games.find(_filter, {'pgn': 1}).batch_size(BACKFILL_BATCH_SIZE), total=game_count):
+        requests.append(features_update(game_document))
+        if len(requests) >= BACKFILL_BATCH_SIZE:
+            updated += db.games.bulk_write(requests, ordered=False).modified_count
+            requests = []
+    if requests:
+        updated += db.games.bulk_write(requests, ordered=False).modified_count
+    print(f'Stored features for {updated} games')
+    return updated
+
+def add_subparser(action_name, subparsers):
+    parser = subparsers.add_parser(
+        action_name, help='stores per-ply feature arrays on games downloaded before they existed')
+    username_option(parser, required=False)
@@ -1,28 +1,34 @@
-from functools import partial
 import sys
-import time
-from concurrent.futures import ThreadPoolExecutor
-from io import StringIO
 
-from chess.pgn import read_game
 from chess import WHITE, BLACK
 from tqdm import tqdm
 
-from common.db import make_db, fetch_game_from_db
+from common.autotune import apply_auto_tune
+from common.engine import configure_search_limit
+from common.engine_pool import get_engine_pool
+from common.stats import report_stats
+from common.scheduler import run_bounded
+from common.warmup import plan_and_warm
+from common.async_pipeline import analyse_games_async, check_pipeline_options
+from common.db import make_db, fetch_game_from_db, store_game_accuracies, collation
+from common.filters import merge_filters
 from common.util import (
     make_game_generator,
-    get_move_accuracy_for_game,
-    count_user_games,
-    get_user_color,
-    color_as_string
+    get_move_accuracy_for_both_sides,
+    count_user_games
 )
 
 from common.options import (
     username_option,
     color_option,
     limit_option,
+    count_mode_option,
     worker_count_option,
-    remote_engines_option
+    remote_engines_option,
+    ranking_mode_option,
+    search_limit_options,
+    warm_cache_options,
+    pipeline_option
 )
 
 def update_running_accuracy(username, hexdigest, game_accuracy):
@@ -32,88 +38,75 @@ def update_running_accuracy(username, hexdigest, game_accuracy):
         'game_accuracy': game_accuracy
         })
 
+def make_jobs(db, args, game_accuracies):
+    for game_document in make_game_generator(db, args, ['pgn', 'tags', 'white_accuracy', 'black_accuracy']):
+        hexdigest = game_document['hexdigest']
+        if 'best_games' in game_document['tags']:
+            game_accuracies[hexdigest] = {}
+            game_accuracies[hexdigest][WHITE] = game_document['white_accuracy']
+            game_accuracies[hexdigest][BLACK] = game_document['black_accuracy']
+            continue
+        yield hexdigest, game_document['pgn']
+
+def analyse_threaded(db, args, game_accuracies):
+    game_count = count_user_games(db, args)
+    with tqdm(total=game_count, smoothing=False) as pbar:
+        def analyse(job):
+            hexdigest, pgn = job
+            return get_move_accuracy_for_both_sides(pgn, args.ranking_mode)
+        def collect(job, move_accuracy):
+            hexdigest, pgn = job
+            if all(len(move_accuracy[color]) != 0 for color in (WHITE, BLACK)):
+                game_accuracies[hexdigest] = {
+                    color: sum(move_accuracy[color]) / len(move_accuracy[color])
+                    for color in (WHITE, BLACK)
+                }
+                store_game_accuracies(db, hexdigest, game_accuracies[hexdigest])
+            pbar.set_description(f'Analyzed {hexdigest}')
+            pbar.update(1)
+        run_bounded(make_jobs(db, args, game_accuracies), analyse, collect, args.worker_count)
+
+def analyse_asyncio(args, game_accuracies):
+    def collect(hexdigest, move_accuracy):
+        if all(len(move_accuracy[color]) != 0 for color in (WHITE, BLACK)):
+            game_accuracies[hexdigest] = {
+                color: sum(move_accuracy[color]) / len(move_accuracy[color])
+                for color in (WHITE, BLACK)
+            }
+    analyse_games_async(args, collect, both_sides=True,
+                        skip_game=lambda game_document: 'best_games' in game_document['tags'])
+    db = make_db()
+    for hexdigest, accuracies in game_accuracies.items():
+        store_game_accuracies(db, hexdigest, accuracies)
+
+def find_best_games(db, args):
+    _filter = merge_filters(args)
+    _filter.update({'accuracy': {'$gte': 0}})
+    return db.games.find(_filter, {'accuracy': 1, 'when': 1, 'headers.Link': 1}, collation=collation()) \
+        .sort('accuracy', -1).limit(args.count)
+
 def run(args):
     username = args.username
     if not username:
         print('Username is required', file=sys.stderr)
+    if not check_pipeline_options(args):
+        return []
     db = make_db()
     game_accuracies = {}
-    game_count = count_user_games(db, args)
-    game_generator = make_game_generator(db, args)
-    with ThreadPoolExecutor(max_workers=args.worker_count) as executor:
-        with tqdm(total=game_count*2, smoothing=False) as pbar:
-            active_threads = set()
-            def pop_future1(game_accuracies, player_color, hexdigest, future):
-                move_accuracy = future.result()
-                if len(move_accuracy) != 0:
-                    game_accuracy = sum(move_accuracy) / len(move_accuracy)
-                    if hexdigest not in game_accuracies:
-                        game_accuracies[hexdigest] = {BLACK: None, WHITE: None}
-                    game_accuracies[hexdigest][player_color] = game_accuracy
-                    if all(game_accuracies[hexdigest].values()):
-                        result = db.games.update_one({'hexdigest': hexdigest}, 
-                                                {
-                                                    '$set': { 
-                                                        'white_accuracy': game_accuracies[hexdigest][WHITE],
-                                                        'black_accuracy' : game_accuracies[hexdigest][BLACK]
-                                                        },
-                                                    '$addToSet': { 'tags': 'best_games'}
-                                             })
-                        if result.modified_count != 1:
-                            raise AttributeError(f'Game {hexdigest} was not updated, with this game_accuracy pair: {game_accuracies[hexdigest]}')
-                active_threads.remove(future)
-                pbar.update(1)
-            while True:
-                try:
-                    while len(active_threads) >= args.worker_count:
-                        time.sleep(0.1)
-                    game_document = next(game_generator)
-                    pgn = game_document['pgn']
-                    hexdigest = game_document['hexdigest']
-                    game = read_game(StringIO(pgn))
-                    user_color = get_user_color(username, game)
-                    other_user = game.headers[color_as_string(not user_color).capitalize()]
-                    other_user_color = not user_color
-                    if 'best_games' in game_document['tags']:
-                        game_accuracies[hexdigest] = {}
-                        game_accuracies[hexdigest][WHITE] = game_document['white_accuracy']
-                        game_accuracies[hexdigest][BLACK] = game_document['black_accuracy']
-                        continue
-                    pbar.set_description(f'Analyzing {hexdigest}')
-                    pop_future_user = partial(pop_future1, game_accuracies, user_color, hexdigest)
-                    pop_future_opponent = partial(pop_future1, game_accuracies, other_user_color, hexdigest)
-                    future_user = executor.submit(get_move_accuracy_for_game,
-                                             pgn,
-                                             username)
-                    future_opponent = executor.submit(get_move_accuracy_for_game,
-                                             pgn,
-                                             other_user)
-                    active_threads.add(future_user)
-                    active_threads.add(future_opponent)
-                    future_user.add_done_callback(pop_future_user)
-                    future_opponent.add_done_callback(pop_future_opponent)
-                except StopIteration:
-                    break
-        while len(active_threads) > 0:
-            time.sleep(0.1)
-    results = db.games.aggregate([
-        {
-            "$project": {
-                "_id": 1,
-                "white_accuracy": 1,
-                "black_accuracy": 1,
-                "accuracy": {"$avg": ["$white_accuracy", "$black_accuracy"]},
-                "when": 1,
-                "headers.Link": 1,
-            }
-        },
-        {
-            "$sort": {"accuracy": -1}
-        },
-        {
-            "$limit": args.count
-        }
-    ])
+    configure_search_limit(args)
+    apply_auto_tune(args)
+    if args.warm_cache or args.plan_only:
+        get_engine_pool(args.worker_count)
+        plan_and_warm(db, args, both_sides=True)
+        if args.plan_only:
+            return []
+    if args.pipeline == 'asyncio':
+        analyse_asyncio(args, game_accuracies)
+    else:
+        get_engine_pool(args.worker_count)
+        analyse_threaded(db, args, game_accuracies)
+    report_stats()
+    results = find_best_games(db, args)
     complete_games_by_accuracy = []
     for projection in results:
         complete_games_by_accuracy.append({
@@ -121,7 +114,6 @@ def run(args):
             'when': projection['when'].timestamp(),
             'accuracy': projection['accuracy']
         })
-    db.client.close()
     return complete_games_by_accuracy
 
 def add_subparser(action_name, subparsers):
@@ -129,8 +121,13 @@ def add_subparser(action_name, subparsers):
     username_option(parser)
     color_option(parser)
     limit_option(parser)
+    count_mode_option(parser)
     worker_count_option(parser)
     remote_engines_option(parser)
+    ranking_mode_option(parser)
+    search_limit_options(parser)
+    warm_cache_options(parser)
+    pipeline_option(parser)
     parser.add_argument(
         '-C',
         '--count',
@@ -0,0 +1,99 @@
+import sys
+from datetime import datetime, timezone
+
+from common.db import make_db, collation
+from common.filters import merge_filters
+from common.job_queue import QUEUED, RUNNING
+from common.options import username_option, color_option
+
+def audited_queries(db, args):
+    games_filter = merge_filters(args)
+    games_filter.update({'invalid': { '$exists': False }})
+    game = db.games.find_one(games_filter, {'hexdigest': 1}) or {'hexdigest': ''}
+    return [
+        ('user games', 'games', {
+            'find': 'games', 'filter': games_filter, 'collation': collation().document}),
+        ('game by digest', 'games', {
+            'find': 'games', 'filter': {'hexdigest': game['hexdigest']}}),
+        ('move accuracy of a player', 'move_accuracy', {
+            'find': 'move_accuracy', 'filter': {'hexdigest': game['hexdigest'], 'username': args.username}}),
+        ('move accuracy of both players', 'move_accuracy', {
+            'find': 'move_accuracy', 'filter': {'hexdigest': game['hexdigest'], 'username': {'$in': [args.username]}}}),
+        ('cached evaluations', 'position_evaluations', {
+            'find': 'position_evaluations', 'filter': {'zobrist': 0, 'search': '', 'move': {'$in': ['e2e4']}}}),
+        ('job claim', 'analysis_jobs', {
+            'findAndModify': 'analysis_jobs',
+            'query': {'$or': [{'status': QUEUED}, {'status': RUNNING, 'lease_expires': {'$lt': datetime.now(timezone.utc)}}]},
+            'update': {'$set': {'status': RUNNING}}}),
+        ('accuracy per square summary', 'accuracy_per_square', {
+            'find': 'accuracy_per_square', 'filter': {'username': args.username}}),
+        ('accuracy per square processed games', 'accuracy_per_square_games', {
+            'find': 'accuracy_per_square_games',
+            'filter': {'username': args.username, 'hexdigest': {'$in': [game['hexdigest']]}}}),
+        ('rollup refresh', 'move_accuracy', {
+            'find': 'move_accuracy', 'filter': {'username': args.username, 'completed_at': {'$gt': datetime.min}},
+            'sort': {'completed_at': 1, '_id': 1}}),
+        ('games played summary', 'games_played_summary', {
+            'find': 'games_played_summary', 'filter': {'username': args.username}}),
+        ('best games', 'games', {
+            'find': 'games', 'filter': dict(games_filter, accuracy={'$gte': 0}), 'sort': {'accuracy': -1},
+            'limit': 10, 'collation': collation().document}),
+    ]
+
+def find_plans(explanation):
+    if isinstance(explanation, dict):
+        if 'winningPlan' in explanation:
+            yield explanation['winningPlan']
+        for value in explanation.values():
+            yield from find_plans(value)
+    elif isinstance(explanation, list):
+        for value in explanation:
+            yield from find_plans(value)
+
+def plan_stages(plan):
+    # classic plans nest through inputStage(s), slot based plans wrap them in queryPlan
+    plan = plan.get('queryPlan', plan)
+    yield plan['stage'], plan.get('indexName')
+    for child in [plan.get('inputStage')] + plan.get('inputStages', []):
+        if child:
+            yield from plan_stages(child)
+
+def explain(db, command):
+    explanation = db.command({'explain': command, 'verbosity': 'queryPlanner'})
+    return [stage for plan in find_plans(explanation) for stage in plan_stages(plan)]
+
+def index_usage(db, collection):
+    return {stats['name']: stats['accesses']['ops'] for stats in db[collection].aggregate([{'$indexStats': {}}])}
+
+def run(args):
+    db = make_db()
+    if not args.username:
+        game = db.games.find_one({}, {'headers.White': 1})
+        args.username = game['headers']['White'] if game else ''
+    report = []
+    for name, collection, command in audited_queries(db, args):
+        stages = explain(db, command)
+        indexes = sorted({index for _, index in stages if index})
+        collscan = any(stage == 'COLLSCAN' for stage, _ in stages)
+        report.append({'query': name, 'collection': collection, 'indexes': indexes, 'collscan': collscan})
+        print(f'{"COLLSCAN" if collscan else "ok":8} {name}: {", ".join(indexes) or "no index"}')
+    for collection in sorted({entry['collection'] for entry in report}):
+        for index, ops in sorted(index_usage(db, collection).items()):
+            print(f'{collection}.{index}: {ops} uses since startup{" (unused)" if ops == 0 else ""}')
+    collscans = [entry['query'] for entry in report if entry['collscan']]
+    if collscans:
+        print(f'Collection scans: {", ".join(collscans)}', file=sys.stderr)
+        if args.fail_on_collscan:
+            sys.exit(1)
+    return report
+
+def add_subparser(action_name, subparsers):
+    parser = subparsers.add_parser(
+        action_name, help='explains the queries the modules issue and flags collection scans')
+    username_option(parser, required=False)
+    color_option(parser)
+    parser.add_argument(
+        '--fail-on-collscan',
+        action='store_true',
+        help='exit with an error when a query scans a whole collection'
+    )
@@ -11,6 +11,7 @@ from chess.pgn import read_game
 from dateutil.relativedelta import relativedelta
 
 from common.db import make_db
+from common.features import extract_features
 from common.util import get_game_datetime, hash_pgn
 from common.options import username_option, limit_option
 from common.config import config
@@ -62,6 +63,7 @@ def run(args):
                         'pgn': pgn,
                         'when': get_game_datetime(pgn),
                         'hexdigest': hash_pgn(pgn),
+                        'features': extract_features(game),
                         'tags': []
                         }
                 try:
@@ -0,0 +1,140 @@
+import asyncio
+import sys
+
+from common.config import config
+from common.tcp_engine import DEFAULT_ENGINE_SERVER_PORT
+
+RESET_TIMEOUT_SECONDS = 10
+
+class EngineProcess:
+    def __init__(self, command: list[str]):
+        self.command = command
+        self.process = None
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self) -> None:
+        self.process = await asyncio.create_subprocess_exec(
+            *self.command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            start_new_session=True)
+        # load the engine and its tablebases before the first client arrives
+        await self.send(f'setoption name SyzygyPath value {config["syzygy-path"]}')
+        await self.send('isready')
+        await self.read_until('readyok')
+
+    async def send(self, line: str) -> None:
+        self.process.stdin.write(f'{line}\n'.encode('utf-8'))
+        await self.process.stdin.drain()
+
+    async def readline(self) -> bytes:
+        line = await self.process.stdout.readline()
+        if not line:
+            raise ConnectionResetError('engine process died')
+        return line
+
+    async def read_until(self, token: str) -> None:
+        while (await self.readline()).strip() != token.encode('utf-8'):
+            pass
+
+    async def reset(self) -> None:
+        await self.send('stop')
+        await self.send('ucinewgame')
+        await self.send('isready')
+        await asyncio.wait_for(self.read_until('readyok'), RESET_TIMEOUT_SECONDS)
+
+    def kill(self) -> None:
+        if self.alive:
+            self.process.kill()
+
+async def relay_engine_output(engine: EngineProcess, writer: asyncio.StreamWriter) -> None:
+    while True:
+        writer.write(await engine.readline())
+        await writer.drain()
+
+async def relay_client_commands(engine: EngineProcess, reader: asyncio.StreamReader) -> None:
+    while line := await reader.readline():
+        command = line.decode('utf-8').strip()
+        # quit ends the session, the engine stays warm for the next client
+        if command == 'quit':
+            return
+        await engine.send(command)
+
+async def serve_session(idle: asyncio.Queue, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    engine = await idle.get()
+    tasks = set()
+    try:
+        if not engine.alive:
+            await engine.start()
+        tasks = {asyncio.create_task(relay_engine_output(engine, writer)),
+                 asyncio.create_task(relay_client_commands(engine, reader))}
+        # whichever side stops first ends the session, a dead engine closes the
+        # connection so the client sees it instead of waiting for a bestmove
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    except (ConnectionError, OSError) as e:
+        print(f'Session ended: {e}', file=sys.stderr)
+    finally:
+        for task in tasks:
+            task.cancel()
+        writer.close()
+        try:
+            if engine.alive:
+                await engine.reset()
+        except (ConnectionError, OSError, asyncio.TimeoutError):
+            engine.kill()
+        idle.put_nowait(engine)
+
+async def serve(args) -> None:
+    idle = asyncio.Queue()
+    engines = [EngineProcess(args.engine_command.split()) for _ in range(args.engines)]
+    await asyncio.gather(*(engine.start() for engine in engines))
+    for engine in engines:
+        idle.put_nowait(engine)
+    server = await asyncio.start_server(
+        lambda reader, writer: serve_session(idle, reader, writer), args.host, args.port)
+    print(f'Serving {args.engines} engines on {args.host}:{args.port}', file=sys.stderr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        for engine in engines:
+            engine.kill()
+
+def run(args):
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+def add_subparser(action_name, subparsers):
+    parser = subparsers.add_parser(
+        action_name, help='keeps warm engines on this host and serves UCI sessions over tcp')
+    parser.add_argument(
+        '--host',
+        default='127.0.0.1',
+        help='address to listen on'
+    )
+    parser.add_argument(
+        '-p',
+        '--port',
+        type=int,
+        default=DEFAULT_ENGINE_SERVER_PORT,
+        help='port to listen on'
+    )
+    parser.add_argument(
+        '-e',
+        '--engines',
+        type=int,
+        default=4,
+        help='how many engine processes to keep running'
+    )
+    parser.add_argument(
+        '--engine-command',
+        default='stockfish',
+        help='command that starts a UCI engine'
+    )
@@ -0,0 +1,80 @@
+import sys
+from io import StringIO
+
+from chess.pgn import read_game
+from tqdm import tqdm
+
+from common.db import make_db
+from common.engine import configure_search_limit, is_deterministic_limit
+from common.job_queue import game_job, position_job, enqueue_jobs, count_jobs_by_status
+from common.util import (
+    make_game_generator,
+    count_user_games,
+    get_user_color,
+    color_as_string
+)
+from common.warmup import count_positions, select_hot_positions
+from common.options import (
+    username_option,
+    color_option,
+    limit_option,
+    count_mode_option,
+    ranking_mode_option,
+    search_limit_options,
+    warm_cache_options
+)
+
+def make_game_jobs(db, args):
+    for game_document in make_game_generator(db, args, ['pgn']):
+        game = read_game(StringIO(game_document['pgn']))
+        if args.both_sides:
+            players = {'white': game.headers['White'], 'black': game.headers['Black']}
+        else:
+            players = {color_as_string(get_user_color(args.username, game)): args.username}
+        yield game_job(game_document['hexdigest'], players, args.ranking_mode)
+
+def make_position_jobs(db, args):
+    occurrences, fens, move_counts = count_positions(db, args, args.both_sides)
+    for position in select_hot_positions(occurrences, move_counts, args.warm_min_count):
+        yield position_job(position, fens[position], args.ranking_mode)
+
+def run(args):
+    if not args.username:
+        print('Username is required', file=sys.stderr)
+    configure_search_limit(args)
+    db = make_db()
+    if args.positions:
+        if not is_deterministic_limit():
+            print('Position jobs need --search-nodes or --search-depth', file=sys.stderr)
+            return None
+        jobs = list(make_position_jobs(db, args))
+    else:
+        game_count = count_user_games(db, args)
+        jobs = list(tqdm(make_game_jobs(db, args), total=game_count))
+    enqueued = enqueue_jobs(db, jobs)
+    print(f'Enqueued {enqueued} new jobs ({len(jobs) - enqueued} already queued)')
+    status = count_jobs_by_status(db)
+    print(', '.join(f'{count} {name}' for name, count in sorted(status.items())))
+    return status
+
+def add_subparser(action_name, subparsers):
+    parser = subparsers.add_parser(
+        action_name, help='queues games or positions for analysis by workers on any node')
+    username_option(parser)
+    color_option(parser)
+    limit_option(parser)
+    count_mode_option(parser)
+    ranking_mode_option(parser)
+    search_limit_options(parser)
+    warm_cache_options(parser)
+    parser.add_argument(
+        '-b',
+        '--both-sides',
+        action='store_true',
+        help="analyse the opponent's moves too, as best_games does"
+    )
+    parser.add_argument(
+        '--positions',
+        action='store_true',
+        help='queue the frequent positions of the selected games instead of the games'
+    )
@@ -1,16 +1,6 @@
-from io import StringIO
-
-from tqdm import tqdm
-from chess.pgn import read_game
-
-from common.util import (
-    make_game_generator,
-    get_game_result,
-    read_game,
-    hash_pgn,
-    count_user_games
-)
-from common.options import username_option, color_option, limit_option
+from common.util import get_game_result_from_headers, game_result_expression, aggregate_user_games
+from common.options import username_option, color_option, limit_option, count_mode_option, aggregate_option
+from common.reports import Report, run_report
 from common.db import make_db
 
 def fetch_summary_from_db(db, args):
@@ -25,47 +15,95 @@ def fetch_summary_from_db(db, args):
         return initialization
     return games_played_summary
 
-def run(args):
-    db = make_db()
-    game_generator = make_game_generator(db, args)
-    summary_document = fetch_summary_from_db(db, args)
-    summary = summary_document['summary']
-    hexdigests = summary_document['hexdigests']
-    count = count_user_games(db, args)
-    for game_document in tqdm(game_generator, total=count):
-        pgn = game_document['pgn']
-        hexdigest = hash_pgn(pgn)
-        if hexdigest in hexdigests:
-            continue
-        game = read_game(StringIO(pgn))
-        split_date = game.headers["Date"].split('.')
+class GamesPlayedReport(Report):
+    fields = ['headers.Date', 'headers.White', 'headers.Black', 'headers.Result']
+
+    def __init__(self, args):
+        super().__init__(args)
+        self.summary = {}
+        self.hexdigests = []
+        self.seen = set()
+
+    def start(self, db, args):
+        summary_document = fetch_summary_from_db(db, args)
+        self.summary = summary_document['summary']
+        self.hexdigests = summary_document['hexdigests']
+        self.seen = set(self.hexdigests)
+
+    def add(self, game_document, features):
+        hexdigest = game_document['hexdigest']
+        if hexdigest in self.seen:
+            return
+        headers = game_document['headers']
+        split_date = headers["Date"].split('.')
         year = split_date[0]
         month = split_date[1]
-        if year not in summary:
-            summary[year] = {}
-        if month not in summary[year]:
-            summary[year][month] = {'wins': 0, 'losses': 0, 'draws': 0}
-        result = get_game_result(game, args.username)
+        if year not in self.summary:
+            self.summary[year] = {}
+        if month not in self.summary[year]:
+            self.summary[year][month] = {'wins': 0, 'losses': 0, 'draws': 0}
+        result = get_game_result_from_headers(headers, self.username)
         if result == 1:
-            summary[year][month]['wins'] += 1
+            self.summary[year][month]['wins'] += 1
         if result == -1:
-            summary[year][month]['losses'] += 1
+            self.summary[year][month]['losses'] += 1
         if result == 0.5:
-            summary[year][month]['draws'] += 1
-        hexdigests += [hexdigest]
-    new_summary_document = {
-        'username': args.username,
-        'summary': summary,
-        'hexdigests': hexdigests
-    }
-    db.games_played_summary.replace_one({
-        'username': args.username, 
-        }, new_summary_document, upsert=True)
+            self.summary[year][month]['draws'] += 1
+        self.hexdigests += [hexdigest]
+        self.seen.add(hexdigest)
+
+    def finish(self, db, args):
+        new_summary_document = {
+            'username': args.username,
+            'summary': self.summary,
+            'hexdigests': self.hexdigests
+        }
+        db.games_played_summary.replace_one({
+            'username': args.username, 
+            }, new_summary_document, upsert=True)
+        return self.summary
+
+def aggregate_summary(db, args):
+    groups = aggregate_user_games(db, args, [
+        {'$project': {
+            '_id': 0,
+            'date': {'$split': ['$headers.Date', '.']},
+            'result': game_result_expression(args.username)
+        }},
+        {'$group': {
+            '_id': {'year': {'$arrayElemAt': ['$date', 0]}, 'month': {'$arrayElemAt': ['$date', 1]}},
+            'wins': {'$sum': {'$cond': [{'$eq': ['$result', 1]}, 1, 0]}},
+            'losses': {'$sum': {'$cond': [{'$eq': ['$result', -1]}, 1, 0]}},
+            'draws': {'$sum': {'$cond': [{'$eq': ['$result', 0.5]}, 1, 0]}}
+        }},
+        {'$sort': {'_id.year': 1, '_id.month': 1}}
+    ])
+    summary = {}
+    for group in groups:
+        summary.setdefault(group['_id']['year'], {})[group['_id']['month']] = {
+            'wins': group['wins'], 'losses': group['losses'], 'draws': group['draws']
+        }
+    return summary
+
+def make_report(args):
+    return GamesPlayedReport(args)
+
+def print_report(summary):
     print(summary)
+
+def run(args):
+    db = make_db()
+    if args.aggregate:
+        summary = aggregate_summary(db, args)
+    else:
+        summary = run_report(db, args, make_report(args))
+    print_report(summary)
     return summary
 
 def add_subparser(action_name, subparsers):
     games_played_parser = subparsers.add_parser(
         action_name, help='summary of games played')
     username_option(games_played_parser)
-    limit_option(games_played_parser)
\ No newline at end of file
+    limit_option(games_played_parser)
+    count_mode_option(games_played_parser)
+    aggregate_option(games_played_parser)
\ No newline at end of file
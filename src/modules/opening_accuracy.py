@@ -1,45 +1,53 @@
-from io import StringIO
+from common.db import make_db
+from common.options import username_option, color_option, limit_option, count_mode_option, rollup_option
+from common.reports import Report, run_report
+from common.rollups import refresh_rollup, rollup_means, rollup_colors
 
-from tqdm import tqdm
-from chess.pgn import read_game
+class OpeningAccuracyReport(Report):
+    fields = ['headers.ECO']
+    with_move_accuracy = True
 
-from common.db import make_db
-from common.util import (
-    make_game_generator,
-    count_user_games,
-    fetch_move_accuracy_from_db,
-    hash_pgn
-)
-from common.options import username_option, color_option, limit_option
+    def __init__(self, args):
+        super().__init__(args)
+        self.opening_accuracy = {}
 
-def run(args):
-    db = make_db()
-    game_generator = make_game_generator(db, args)
-    game_count = count_user_games(db, args)
-    opening_accuracy = {}
-    actual_game_count = 0
-    for game_document in tqdm(game_generator, total=game_count):
-        pgn = game_document['pgn']
-        move_accuracy = fetch_move_accuracy_from_db(db, hash_pgn(pgn), args.username)
+    def add(self, game_document, features):
+        move_accuracy = game_document['move_accuracy']
         if not move_accuracy:
-            continue
+            return
         game_accuracy = sum(move_accuracy)/len(move_accuracy)
-        game = read_game(StringIO(pgn))
-        if 'ECO' not in game.headers:
-            continue
-        opening = game.headers['ECO']
-        if opening not in opening_accuracy:
-            opening_accuracy[opening] = []
-        opening_accuracy[opening] += [game_accuracy]
-    for opening, accuracy in opening_accuracy.items():
-        opening_accuracy[opening] = sum(accuracy)/len(accuracy)
+        if 'ECO' not in game_document['headers']:
+            return
+        opening = game_document['headers']['ECO']
+        if opening not in self.opening_accuracy:
+            self.opening_accuracy[opening] = []
+        self.opening_accuracy[opening] += [game_accuracy]
+
+    def finish(self, db, args):
+        return {opening: sum(accuracy)/len(accuracy) for opening, accuracy in self.opening_accuracy.items()}
+
+def make_report(args):
+    return OpeningAccuracyReport(args)
+
+def print_report(opening_accuracy):
     for opening, accuracy in opening_accuracy.items():
         print(f'Opening {opening}: {accuracy*100:.2f}%')
 
+def run(args):
+    db = make_db()
+    if args.rollup:
+        opening_accuracy = rollup_means(refresh_rollup(db, args.username), 'openings', rollup_colors(args))
+    else:
+        opening_accuracy = run_report(db, args, make_report(args))
+    print_report(opening_accuracy)
+    return opening_accuracy
+
 def add_subparser(action_name, subparsers):
     accuracy_by_opening_parser = subparsers.add_parser(
         action_name, help='identifies accuracy by opening')
     username_option(accuracy_by_opening_parser)
     color_option(accuracy_by_opening_parser)
     limit_option(accuracy_by_opening_parser)
+    count_mode_option(accuracy_by_opening_parser)
+    rollup_option(accuracy_by_opening_parser)
     
\ No newline at end of file
@@ -1,33 +1,57 @@
-from io import StringIO
+from common.db import make_db
+from common.util import get_game_result_from_headers, game_result_expression, aggregate_user_games
+from common.options import username_option, color_option, limit_option, count_mode_option, aggregate_option
+from common.reports import Report, run_report
 
-from tqdm import tqdm
-from chess.pgn import read_game
+class OpeningScoreReport(Report):
+    fields = ['headers']
 
-from common.db import make_db
-from common.util import make_game_generator, count_user_games, get_game_result
-from common.options import username_option, color_option, limit_option
+    def __init__(self, args):
+        super().__init__(args)
+        self.opening_scores = {}
 
-def run(args):
-    db = make_db()
-    game_generator = make_game_generator(db, args)
-    game_count = count_user_games(db, args)
-    opening_scores = {}
-    for game_document in tqdm(game_generator, total=game_count):
-        pgn = game_document['pgn']
-        game = read_game(StringIO(pgn))
-        if 'ECO' not in game.headers:
-            continue
-        opening = game.headers['ECO']
-        result = get_game_result(game, args.username)
-        if opening not in opening_scores:
-            opening_scores[opening] = 0
-        opening_scores[opening] += result
+    def add(self, game_document, features):
+        headers = game_document['headers']
+        if 'ECO' not in headers:
+            return
+        opening = headers['ECO']
+        result = get_game_result_from_headers(headers, self.username)
+        if opening not in self.opening_scores:
+            self.opening_scores[opening] = 0
+        self.opening_scores[opening] += result
+
+    def finish(self, db, args):
+        return self.opening_scores
+
+def aggregate_opening_scores(db, args):
+    groups = aggregate_user_games(db, args, [
+        {'$match': {'headers.ECO': {'$exists': True}}},
+        {'$group': {'_id': '$headers.ECO', 'score': {'$sum': game_result_expression(args.username)}}},
+        {'$sort': {'_id': 1}}
+    ])
+    return {group['_id']: group['score'] for group in groups}
+
+def make_report(args):
+    return OpeningScoreReport(args)
+
+def print_report(opening_scores):
     for opening, score in opening_scores.items():
         print(f'Opening {opening}: {score}')
 
+def run(args):
+    db = make_db()
+    if args.aggregate:
+        opening_scores = aggregate_opening_scores(db, args)
+    else:
+        opening_scores = run_report(db, args, make_report(args))
+    print_report(opening_scores)
+    return opening_scores
+
 def add_subparser(action_name, subparsers):
     score_by_opening_parser = subparsers.add_parser(
         action_name, help='identifies game score by opening')
     username_option(score_by_opening_parser)
     color_option(score_by_opening_parser)
     limit_option(score_by_opening_parser)
+    count_mode_option(score_by_opening_parser)
+    aggregate_option(score_by_opening_parser)
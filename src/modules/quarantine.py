@@ -0,0 +1,33 @@
+from chess import Board
+
+from common.db import make_db
+from common.eval_cache import position_key
+from common.supervisor import release_positions
+
+def run(args):
+    db = make_db()
+    if args.release_all:
+        print(f'Released {release_positions(db)} positions')
+        return None
+    if args.release:
+        print(f'Released {release_positions(db, [position_key(Board(fen)) for fen in args.release])} positions')
+        return None
+    positions = list(db.quarantined_positions.find({}, {'_id': 0}))
+    for position in positions:
+        print(f'{position["fen"]}: {position["failures"]} failures in {len(position["games"])} games, {position["error"]}')
+    return positions
+
+def add_subparser(action_name, subparsers):
+    parser = subparsers.add_parser(
+        action_name, help='lists positions the engine kept crashing on and releases them for analysis')
+    parser.add_argument(
+        '--release',
+        nargs='+',
+        metavar='FEN',
+        help='releases these positions'
+    )
+    parser.add_argument(
+        '--release-all',
+        action='store_true',
+        help='releases every quarantined position'
+    )
@@ -0,0 +1,43 @@
+from common.db import make_db
+from common.reports import run_reports
+from common.util import load_module
+from common.options import (
+    username_option,
+    color_option,
+    limit_option,
+    count_mode_option,
+    pieces_option,
+    date_range_options,
+    variant_option,
+    time_controls_option
+)
+
+REPORTS = [
+    'games_played',
+    'opening_score',
+    'opening_accuracy',
+    'piece_frequency',
+    'accuracy_per_piece',
+    'accuracy_per_square'
+]
+
+def run(args):
+    db = make_db()
+    modules = {name: load_module(name) for name in REPORTS}
+    results = run_reports(db, args, {name: module.make_report(args) for name, module in modules.items()})
+    for name, result in results.items():
+        print(f'{name}:')
+        modules[name].print_report(result)
+    return results
+
+def add_subparser(action_name, subparsers):
+    parser = subparsers.add_parser(
+        action_name, help='computes every report in a single pass over the games')
+    username_option(parser)
+    color_option(parser)
+    limit_option(parser)
+    count_mode_option(parser)
+    pieces_option(parser)
+    date_range_options(parser)
+    variant_option(parser)
+    time_controls_option(parser)
@@ -0,0 +1,109 @@
+import sys
+import time
+from io import StringIO
+
+from chess import Board, WHITE, BLACK
+from chess.pgn import read_game
+from tqdm import tqdm
+
+from common.budget import get_budget_policy
+from common.config import config
+from common.db import make_db, fetch_game_from_db, store_game_accuracies
+from common.autotune import apply_auto_tune
+from common.engine import configure_search_limit, searching_with, is_deterministic_limit
+from common.engine_pool import get_engine_pool
+from common.job_queue import (
+    make_worker_id,
+    claim_job,
+    complete_job,
+    fail_job,
+    Heartbeat
+)
+from common.scheduler import run_bounded
+from common.stats import report_stats
+from common.util import get_move_accuracy_for_players, evaluate_position, string_as_color
+from common.options import (
+    worker_count_option,
+    remote_engines_option,
+    search_limit_options
+)
+
+def claim_jobs(db, worker_id, heartbeat, exit_when_empty):
+    while True:
+        job = claim_job(db, worker_id)
+        if job is None:
+            if exit_when_empty:
+                return
+            time.sleep(config['job-poll-seconds'])
+            continue
+        heartbeat.add(job['_id'])
+        yield job
+
+def process_game_job(db, job):
+    game_document = fetch_game_from_db(db, job['hexdigest'])
+    pgn = game_document['pgn']
+    players = {string_as_color(color): username for color, username in job['players'].items()}
+    move_accuracy = get_move_accuracy_for_players(pgn, read_game(StringIO(pgn)), players, job['ranking_mode'])
+    if len(players) == 2 and all(len(move_accuracy[color]) != 0 for color in (WHITE, BLACK)):
+        store_game_accuracies(db, job['hexdigest'], {
+            color: sum(move_accuracy[color]) / len(move_accuracy[color])
+            for color in (WHITE, BLACK)
+        })
+
+def process_position_job(db, job):
+    if 'search_limit' not in job:
+        raise ValueError('Position job was queued without its search limit')
+    board = Board(job['fen'])
+    with searching_with(job['search_limit']):
+        # anything else would only reach this worker's memory cache
+        if not is_deterministic_limit():
+            raise ValueError('Position jobs need a node or depth limit')
+        with get_engine_pool().lease() as engine:
+            evaluate_position(db, board, engine, job['ranking_mode'], get_budget_policy().initial_factor(board))
+
+def process_job(db, job):
+    try:
+        if job['kind'] == 'game':
+            process_game_job(db, job)
+        else:
+            process_position_job(db, job)
+    except Exception as e: # pylint: disable=W0718
+        return repr(e)
+    return None
+
+def run(args):
+    configure_search_limit(args)
+    apply_auto_tune(args)
+    get_engine_pool(args.worker_count)
+    db = make_db()
+    worker_id = make_worker_id()
+    heartbeat = Heartbeat(db, worker_id)
+    heartbeat.start()
+    with tqdm(smoothing=False) as pbar:
+        def finish(job, error):
+            heartbeat.remove(job['_id'])
+            if error:
+                print(f'Job {job["_id"]} failed: {error}', file=sys.stderr)
+                fail_job(db, job, error)
+            else:
+                complete_job(db, job)
+            pbar.set_description(f'{worker_id} finished {job["_id"]}')
+            pbar.update(1)
+        try:
+            run_bounded(claim_jobs(db, worker_id, heartbeat, args.exit_when_empty),
+                        lambda job: process_job(db, job), finish, args.worker_count, backlog=0)
+        finally:
+            heartbeat.stop()
+    report_stats()
+
+def add_subparser(action_name, subparsers):
+    parser = subparsers.add_parser(
+        action_name, help='claims and runs queued analysis jobs until stopped')
+    worker_count_option(parser)
+    remote_engines_option(parser)
+    search_limit_options(parser)
+    parser.add_argument(
+        '--exit-when-empty',
+        action='store_true',
+        help='stop once no job is left to claim instead of polling for new ones'
+    )
@@ -0,0 +1,147 @@
+import statistics
+import unittest
+from io import StringIO
+from unittest.mock import MagicMock, patch
+
+import mongomock
+
+from chess import Board, Move, WHITE
+from chess.engine import PovScore, Cp, EngineTerminatedError
+from chess.pgn import read_game
+
+from src.common.config import config
+from src.common.db import checkpoint_move_accuracy, checkpoint_pipeline
+from src.common.util import get_move_accuracy, get_move_accuracy_for_players, score_move, hash_pgn
+from src.common.eval_cache import eval_cache
+from src.common.supervisor import EngineSupervisor, PositionQuarantined
+from src.common.sampling import RunningEstimate
+
+def make_mock_engine(move_scores):
+    def analyse(board, limit, root_moves=None, multipv=1, info=None):
+        moves = sorted(root_moves, key=lambda move: -move_scores[move.uci()])[:multipv]
+        return [{'pv': [move], 'score': PovScore(Cp(move_scores[move.uci()]), board.turn)}
+                for move in moves]
+    engine = MagicMock()
+    engine.analyse.side_effect = analyse
+    return engine
+
+class TestAccuracy(unittest.TestCase):
+
+    def setUp(self):
+        eval_cache.entries.clear()
+
+    def test_ranking_modes_agree(self):
+        board = Board()
+        move_scores = {move.uci(): (idx % 7) * 10 for idx, move in enumerate(board.legal_moves)}
+        for move in board.legal_moves:
+            eval_cache.entries.clear()
+            per_move_engine = make_mock_engine(move_scores)
+            multipv_engine = make_mock_engine(move_scores)
+            per_move = get_move_accuracy(None, board, per_move_engine, move, None, 'per-move')
+            multipv = get_move_accuracy(None, board, multipv_engine, move, None, 'multipv')
+            self.assertEqual(per_move, multipv)
+            self.assertEqual(per_move_engine.analyse.call_count, board.legal_moves.count())
+            self.assertEqual(multipv_engine.analyse.call_count, 1)
+
+    def test_best_move_is_fully_accurate(self):
+        board = Board()
+        move_scores = {move.uci(): 0 for move in board.legal_moves}
+        move_scores['e2e4'] = 50
+        engine = make_mock_engine(move_scores)
+        accuracy = get_move_accuracy(None, board, engine, Move.from_uci('e2e4'), None, 'multipv')
+        self.assertEqual(accuracy, 1)
+
+    def test_repeated_position_is_served_from_cache(self):
+        board = Board()
+        move_scores = {move.uci(): 0 for move in board.legal_moves}
+        engine = make_mock_engine(move_scores)
+        get_move_accuracy(None, board, engine, Move.from_uci('e2e4'), None, 'per-move')
+        get_move_accuracy(None, board, engine, Move.from_uci('d2d4'), None, 'per-move')
+        self.assertEqual(engine.analyse.call_count, board.legal_moves.count())
+
+    def test_forced_move_skips_engine(self):
+        board = Board('k7/8/8/8/8/8/8/1R5K b - - 0 1')
+        engine = make_mock_engine({})
+        accuracy = get_move_accuracy(None, board, engine, Move.from_uci('a8a7'), None, 'per-move')
+        self.assertEqual(accuracy, 1)
+        engine.analyse.assert_not_called()
+
+    def test_resumes_from_checkpoint(self):
+        pgn = '[White "a"]\n[Black "b"]\n\n1. e4 e5 2. Nf3 Nc6 3. Bb5 *'
+        db = MagicMock()
+        db.move_accuracy.find_one.return_value = {'move_accuracy': [0.5], 'complete': False}
+        db.games.update_one.return_value.matched_count = 1
+        engine = MagicMock()
+        engine.analyse.side_effect = lambda board, limit, **kwargs: [
+            {'pv': [move], 'score': PovScore(Cp(0), board.turn)} for move in kwargs['root_moves']]
+        pool = MagicMock()
+        pool.checkout.return_value = (engine, None)
+        with patch('src.common.util.make_db', return_value=db), \
+             patch('src.common.util.get_engine_pool', return_value=pool), \
+             patch('src.common.checkpoint.checkpoint_move_accuracy', wraps=checkpoint_move_accuracy) as checkpoint:
+            move_accuracy = get_move_accuracy_for_players(pgn, read_game(StringIO(pgn)), {WHITE: 'a'}, 'per-move')
+        self.assertEqual(move_accuracy[WHITE], [0.5, 1.0, 1.0])
+        stored = mongomock.MongoClient().db.move_accuracy
+        stored.insert_one({'hexdigest': hash_pgn(pgn), 'username': 'a', 'move_accuracy': [0.5], 'complete': False})
+        # the resumed plies land after the one already saved, and a replayed write changes nothing
+        for _ in range(2):
+            for call in checkpoint.call_args_list:
+                hexdigest, username, offset, scored, budgets, complete = call.args
+                stored.update_one({'hexdigest': hexdigest, 'username': username},
+                                  checkpoint_pipeline(offset, scored, budgets, complete), upsert=True)
+            document = stored.find_one()
+            self.assertEqual(document['move_accuracy'], [0.5, 1.0, 1.0])
+            self.assertTrue(document['complete'])
+
+    @patch('src.common.supervisor.time.sleep')
+    def test_crashed_engine_is_restarted(self, sleep):
+        crashed_engine = MagicMock()
+        crashed_engine.analyse.side_effect = EngineTerminatedError('engine process died unexpectedly')
+        healthy_engine = make_mock_engine({move.uci(): 0 for move in Board().legal_moves})
+        pool = MagicMock()
+        pool.checkout.side_effect = [(crashed_engine, None), (healthy_engine, None)]
+        with EngineSupervisor(pool) as supervisor:
+            accuracy = supervisor.run(None, Board(), None, lambda engine: get_move_accuracy(
+                None, Board(), engine, Move.from_uci('e2e4'), None, 'multipv'))
+        self.assertEqual(accuracy, 1)
+        pool.checkin.assert_any_call(crashed_engine, None, failed=True)
+        pool.checkin.assert_called_with(healthy_engine, None)
+
+    @patch.dict(config, {'engine-retry-attempts': 0})
+    @patch('src.common.supervisor.quarantined_keys', new=set())
+    @patch('src.common.supervisor.time.sleep')
+    def test_zero_retries_still_tries_once(self, sleep):
+        crashed_engine = MagicMock()
+        crashed_engine.analyse.side_effect = EngineTerminatedError('engine process died unexpectedly')
+        pool = MagicMock()
+        pool.checkout.return_value = (crashed_engine, None)
+        with EngineSupervisor(pool) as supervisor, self.assertRaises(PositionQuarantined):
+            supervisor.run(MagicMock(), Board(), 'hexdigest', lambda engine: engine.analyse())
+        self.assertEqual(crashed_engine.analyse.call_count, 1)
+        # the last failure is not followed by a restart
+        self.assertEqual(pool.checkout.call_count, 1)
+        sleep.assert_not_called()
+        pool.checkin.assert_called_once_with(crashed_engine, None, failed=True)
+
+    @patch.dict(config, {'budget-policy': 'adaptive'})
+    def test_adaptive_budget_escalates_only_uncertain_ranks(self):
+        board = Board()
+        move_scores = {move.uci(): 0 for move in board.legal_moves}
+        move_scores['e2e4'] = 300
+        engine = make_mock_engine(move_scores)
+        self.assertEqual(score_move(None, board, engine, Move.from_uci('e2e4'), 'multipv'), (1, 0.25))
+        move_scores['d2d4'] = 290
+        eval_cache.entries.clear()
+        self.assertEqual(score_move(None, board, engine, Move.from_uci('e2e4'), 'multipv'), (1, 4))
+        self.assertEqual(engine.analyse.call_count, 4)
+
+    def test_running_estimate_matches_sample_statistics(self):
+        values = [0.2, 0.9, 0.5, 0.65, 0.4]
+        estimate = RunningEstimate(population=1000, confidence=0.95)
+        for value in values:
+            estimate.add(value)
+        self.assertAlmostEqual(estimate.mean, statistics.mean(values))
+        expected = 1.959964 * statistics.stdev(values) / len(values) ** 0.5 * (995 / 999) ** 0.5
+        self.assertAlmostEqual(estimate.half_width(), expected, places=5)
+        estimate.population = len(values)
+        self.assertEqual(estimate.half_width(), 0)
@@ -0,0 +1,62 @@
+import pickle
+import unittest
+from argparse import Namespace
+from unittest.mock import MagicMock
+
+import numpy as np
+from bson import Binary
+from chess import WHITE, BLACK, PAWN, KNIGHT
+
+from src.modules.accuracy_per_square import AccuracyPerSquareReport, PIECES, empty_state, make_heatmap
+
+def make_legacy_document():
+    def matrices(piece_type, value):
+        matrix = np.zeros((8, 8))
+        matrix[4, 3] = value
+        return {piece: matrix if piece == piece_type else np.zeros((8, 8)) for piece in PIECES}
+    return {
+        'username': 'player',
+        'sum_white': Binary(pickle.dumps(matrices(PAWN, 1.5))),
+        'len_white': Binary(pickle.dumps(matrices(PAWN, 2))),
+        'games_white': ['00' * 16],
+        'sum_black': Binary(pickle.dumps(matrices(KNIGHT, 0.5))),
+        'len_black': Binary(pickle.dumps(matrices(KNIGHT, 1))),
+        'games_black': ['11' * 16]
+    }
+
+class TestAccuracyPerSquare(unittest.TestCase):
+
+    def test_legacy_state_is_converted(self):
+        db = MagicMock()
+        db.accuracy_per_square.find_one.return_value = make_legacy_document()
+        args = Namespace(username='player', color=None, pieces=['pawn', 'knight'])
+        report = AccuracyPerSquareReport(args)
+        report.start(db, args)
+        self.assertEqual(report.state['counts'][0, PAWN - 1, 4, 3], 2)
+        self.assertEqual(report.state['counts'][1, KNIGHT - 1, 4, 3], 1)
+        self.assertEqual(report.state['counts'].sum(), 3)
+        # the digests leave the summary and are recorded under the next generation
+        self.assertEqual(db.accuracy_per_square_games.insert_many.call_args[0][0], [
+            {'username': 'player', 'hexdigest': '00' * 16, 'generation': 1},
+            {'username': 'player', 'hexdigest': '11' * 16, 'generation': 1}
+        ])
+        heatmap = report.finish(db, args)
+        self.assertAlmostEqual(heatmap[4][3], 2/3)
+        saved = db.accuracy_per_square.replace_one.call_args[0][1]
+        self.assertEqual(saved['generation'], 1)
+        self.assertNotIn('games_white', saved)
+
+    def test_heatmap(self):
+        state = empty_state()
+        state['sums'][0, PAWN - 1, 0, 1] = 1.8
+        state['counts'][0, PAWN - 1, 0, 1] = 2
+        state['sums'][1, PAWN - 1, 0, 1] = 0.6
+        state['counts'][1, PAWN - 1, 0, 1] = 1
+        state['sums'][0, KNIGHT - 1, 5, 2] = 0.7
+        state['counts'][0, KNIGHT - 1, 5, 2] = 1
+        heatmap = make_heatmap(state, [WHITE, BLACK], ['pawn'])
+        self.assertAlmostEqual(heatmap[0][1], 0.8)
+        self.assertIsNone(heatmap[5][2])
+        heatmap = make_heatmap(state, [BLACK], ['pawn', 'knight'])
+        self.assertAlmostEqual(heatmap[0][1], 0.6)
+        self.assertIsNone(heatmap[5][2])
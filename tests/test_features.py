@@ -0,0 +1,41 @@
+import unittest
+from io import StringIO
+from unittest.mock import MagicMock
+
+from chess.pgn import read_game
+
+from src.common.features import (extract_features, extract_features_from_pgn, decode_features, user_plies,
+                                 piece_symbols, fill_missing_features)
+from src.common.util import get_piece_repr
+
+PGN = '''[White "a"]
+[Black "b"]
+
+1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 4. O-O Nf6 5. d3 O-O 6. Bg5 h6 7. Bxf6 Qxf6 8. Nc3 d6 9. Qd2 Bg4 10. Kh1 *'''
+
+class TestFeatures(unittest.TestCase):
+
+    def test_piece_symbols_match_san(self):
+        game = read_game(StringIO(PGN))
+        features = decode_features(extract_features(game))
+        symbols = piece_symbols(features)[user_plies(features, dict(game.headers), 'a')]
+        board = game.board()
+        expected = []
+        for move in game.mainline_moves():
+            if board.turn:
+                expected.append(get_piece_repr(board, move))
+            board.push(move)
+        self.assertEqual(list(symbols), expected)
+        self.assertEqual(int(features['captures'].sum()), 2)
+
+    def test_missing_features_filled_per_batch(self):
+        db = MagicMock()
+        db.games.find.return_value = [{'_id': 1, 'pgn': PGN}, {'_id': 3, 'pgn': PGN}]
+        game_documents = [{'_id': 1}, {'_id': 2, 'features': extract_features_from_pgn(PGN)}, {'_id': 3}]
+        fill_missing_features(db, game_documents)
+        self.assertEqual(db.games.find.call_args[0][0], {'_id': {'$in': [1, 3]}})
+        db.games.bulk_write.assert_called_once()
+        self.assertEqual(len(db.games.bulk_write.call_args[0][0]), 2)
+        self.assertTrue(all(game_document['features'] == game_documents[1]['features']
+                            for game_document in game_documents))
+        db.games.find_one.assert_not_called()
@@ -0,0 +1,74 @@
+import unittest
+from argparse import Namespace
+from unittest.mock import patch
+
+import mongomock
+
+from src.common.features import extract_features_from_pgn
+from src.common.util import hash_pgn, PIECES_STR, load_module
+
+from common.reports import run_report, run_reports, merge_fields
+from modules.report_all import REPORTS
+from modules.games_played import aggregate_summary
+from modules.opening_score import aggregate_opening_scores
+
+PGNS = [
+    '[White "Player"]\n[Black "other"]\n[Result "1-0"]\n[Date "2023.01.05"]\n[ECO "C20"]\n\n'
+    '1. e4 e5 2. Qh5 Nc6 3. Bc4 Nf6 4. Qxf7# 1-0',
+    '[White "other"]\n[Black "Player"]\n[Result "1/2-1/2"]\n[Date "2023.01.09"]\n[ECO "D00"]\n\n'
+    '1. d4 d5 2. Nf3 Nf6 3. Bg5 e6 1/2-1/2',
+    '[White "other"]\n[Black "PLAYER"]\n[Result "1-0"]\n[Date "2023.02.11"]\n[ECO "B51"]\n\n'
+    '1. e4 c5 2. Nf3 d6 3. Bb5+ Bd7 1-0'
+]
+# the plies played by player in each game
+MOVE_ACCURACIES = [[0.9, 0.5, 0.7, 1.0], [0.8, 0.6, 0.4], [0.3, 0.9, 0.5]]
+
+def make_games_db():
+    db = mongomock.MongoClient().db
+    for idx, pgn in enumerate(PGNS):
+        headers = dict(line[1:-1].split(' ', 1) for line in pgn.split('\n\n')[0].split('\n'))
+        game_document = {
+            'hexdigest': hash_pgn(pgn),
+            'pgn': pgn,
+            'headers': {name: value.strip('"') for name, value in headers.items()},
+            'features': extract_features_from_pgn(pgn)
+        }
+        db.games.insert_one(game_document)
+        db.move_accuracy.insert_one({
+            'hexdigest': hash_pgn(pgn),
+            'username': 'player',
+            'move_accuracy': MOVE_ACCURACIES[idx],
+            'complete': True
+        })
+    return db
+
+# mongomock ignores collations, the games of the case-insensitive player are all there is
+@patch('common.util.merge_filters', return_value={})
+@patch('common.util.collation', return_value=None)
+class TestReports(unittest.TestCase):
+
+    def setUp(self):
+        self.args = Namespace(username='player', color=None, limit=None, count_mode='none', pieces=PIECES_STR)
+        self.modules = {name: load_module(name) for name in REPORTS}
+
+    def test_single_pass_matches_per_module_runs(self, collation, merge_filters):
+        separately = {name: run_report(make_games_db(), self.args, module.make_report(self.args))
+                      for name, module in self.modules.items()}
+        together = run_reports(make_games_db(), self.args,
+                               {name: module.make_report(self.args) for name, module in self.modules.items()})
+        self.assertEqual(together, separately)
+        self.assertEqual(together['games_played'], {
+            '2023': {'01': {'wins': 1, 'losses': 0, 'draws': 1}, '02': {'wins': 0, 'losses': 1, 'draws': 0}}
+        })
+
+    def test_merged_fields_drop_covered_paths(self, collation, merge_filters):
+        reports = [module.make_report(self.args) for module in self.modules.values()]
+        self.assertEqual(merge_fields(reports), ['features', 'headers'])
+
+    def test_aggregate_matches_scan(self, collation, merge_filters):
+        db = make_games_db()
+        scanned = run_reports(db, self.args, {name: self.modules[name].make_report(self.args)
+                                              for name in ('games_played', 'opening_score')})
+        self.assertEqual(aggregate_summary(db, self.args), scanned['games_played'])
+        self.assertEqual(aggregate_opening_scores(db, self.args), scanned['opening_score'])
+        self.assertEqual(scanned['opening_score'], {'C20': 1, 'D00': 0.5, 'B51': -1})
@@ -0,0 +1,64 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import mongomock
+
+from src.common.features import extract_features_from_pgn
+from src.common.rollups import refresh_rollup, rollup_means, empty_rollup, SETTLE_SECONDS
+from src.common.util import hash_pgn
+
+NOW = datetime(2024, 3, 1, 12, 0)
+PGN = '[White "player"]\n[Black "other"]\n[ECO "C20"]\n\n1. e4 e5 2. Nf3 Nc6 *'
+
+def make_db(now=NOW):
+    db = mongomock.MongoClient().db
+    db.games.insert_one({
+        'hexdigest': hash_pgn(PGN),
+        'headers': {'White': 'player', 'Black': 'other', 'ECO': 'C20'},
+        'features': extract_features_from_pgn(PGN)
+    })
+    # mongomock has no hello command, the server clock is set by the test
+    db.command = lambda name: {'localTime': now}
+    return db
+
+def add_analysis(db, move_accuracy, completed_at):
+    return db.move_accuracy.insert_one({
+        'hexdigest': hash_pgn(PGN),
+        'username': 'player',
+        'move_accuracy': move_accuracy,
+        'complete': True,
+        'completed_at': completed_at
+    }).inserted_id
+
+class TestRollups(unittest.TestCase):
+
+    def test_watermark_tie_break(self):
+        db = make_db()
+        completed_at = NOW - timedelta(hours=1)
+        first = add_analysis(db, [0.2, 0.4], completed_at)
+        add_analysis(db, [0.6, 0.8], completed_at)
+        rollup = empty_rollup('player')
+        rollup['watermark'] = {'completed_at': completed_at, '_id': first}
+        db.accuracy_rollups.insert_one(rollup)
+        # only the analysis after the watermark in (completed_at, _id) order is absorbed
+        rollup = refresh_rollup(db, 'player')
+        self.assertEqual(rollup['colors']['white'], {'sum': 1.4, 'count': 2})
+        self.assertEqual(refresh_rollup(db, 'player')['colors']['white'], {'sum': 1.4, 'count': 2})
+
+    def test_recent_analyses_wait_to_settle(self):
+        db = make_db()
+        add_analysis(db, [0.5, 0.5], NOW - timedelta(seconds=SETTLE_SECONDS - 1))
+        self.assertEqual(refresh_rollup(db, 'player')['colors'], {})
+        self.assertIsNone(db.accuracy_rollups.find_one({'username': 'player'}))
+        db.command = lambda name: {'localTime': NOW + timedelta(seconds=2)}
+        self.assertEqual(refresh_rollup(db, 'player')['colors']['white'], {'sum': 1.0, 'count': 2})
+
+    def test_rollup_means(self):
+        rollup = empty_rollup('player')
+        rollup['openings'] = {
+            'white': {'C20': {'sum': 1.5, 'count': 2}, 'B01': {'sum': 0, 'count': 0}},
+            'black': {'C20': {'sum': 0.5, 'count': 2}, 'A00': {'sum': 0.3, 'count': 1}}
+        }
+        self.assertEqual(rollup_means(rollup, 'openings', ['white', 'black']), {'C20': 0.5, 'A00': 0.3})
+        self.assertEqual(rollup_means(rollup, 'openings', ['white']), {'C20': 0.75})
@@ -0,0 +1,37 @@
+import time
+import unittest
+from threading import Event
+
+from src.common.scheduler import run_bounded
+
+class TestScheduler(unittest.TestCase):
+
+    def test_results_handled_while_producer_waits(self):
+        handled = Event()
+        waited = []
+        def idle_producer():
+            yield 1
+            # like a worker polling an empty queue
+            waited.append(handled.wait(timeout=2))
+        run_bounded(idle_producer(), lambda item: time.sleep(0.05), lambda item, result: handled.set(), 2)
+        self.assertEqual(waited, [True])
+
+    def test_in_flight_items_are_bounded(self):
+        in_flight, peak = [0], [0]
+        def produce():
+            for item in range(6):
+                in_flight[0] += 1
+                peak[0] = max(peak[0], in_flight[0])
+                yield item
+        def finish(item, result):
+            in_flight[0] -= 1
+        run_bounded(produce(), lambda item: time.sleep(0.01), finish, 2, backlog=0)
+        self.assertEqual(in_flight[0], 0)
+        self.assertLessEqual(peak[0], 2)
+
+    def test_producer_errors_are_raised(self):
+        def failing_producer():
+            yield 1
+            raise ValueError('broken producer')
+        with self.assertRaises(ValueError):
+            run_bounded(failing_producer(), lambda item: item, lambda item, result: None, 2)